@@ -0,0 +1,133 @@
+import argparse
+import concurrent.futures
+import os
+import random
+import resource
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_graph import FakeGraph
+from synthetic_files import TOPICS, build_site
+from file_cache import FileCache
+from folder_tree import FolderTree
+from graph_client import GraphClient
+from metrics import METRICS
+from pipeline import ParserPool
+from retrievers import make_retriever, answer_threshold
+from sharepoint import ITEMS_PER_PAGE, get_site, list_items, search_files, ingest_search_results, search_answer
+
+
+def percentiles(latencies):
+    latencies = sorted(latencies)
+    return statistics.median(latencies), latencies[max(int(len(latencies) * 0.95) - 1, 0)]
+
+
+# Runs `operation` once per argument and reports latency, throughput and peak Python memory
+def measure(name, operation, arguments, unit, amount=None):
+    tracemalloc.start()
+    latencies = []
+    total = 0
+    start = time.perf_counter()
+    for argument in arguments:
+        operation_start = time.perf_counter()
+        result = operation(argument)
+        latencies.append(time.perf_counter() - operation_start)
+        total += amount(result) if amount else 1
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    p50, p95 = percentiles(latencies)
+    print(f"{name:<22} {len(latencies):>6} {p50 * 1000:>9.1f} {p95 * 1000:>9.1f} {total / elapsed:>12.1f} {unit:<10}"
+          f" {peak / 1e6:>9.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Listing, ingest and question answering against a fake Graph server")
+    parser.add_argument("--files", type=int, default=200)
+    parser.add_argument("--size", type=int, default=20000, help="characters of text per file")
+    parser.add_argument("--formats", default="pdf,docx,csv,txt")
+    parser.add_argument("--folders", type=int, default=4, help="subfolders per folder")
+    parser.add_argument("--depth", type=int, default=2)
+    parser.add_argument("--latency", type=float, default=20, help="milliseconds added to every Graph round trip")
+    parser.add_argument("--questions", type=int, default=20)
+    parser.add_argument("--retriever", default="tfidf")
+    parser.add_argument("--downloads", type=int, default=8)
+    parser.add_argument("--parsers", type=int, default=2)
+    args = parser.parse_args()
+
+    fake = FakeGraph(latency=args.latency / 1000).start()
+    build_site(fake, "bench", args.files, args.formats.split(","), args.size, args.folders, args.depth)
+    graph = GraphClient(base_url=fake.url("/v1.0"))
+    site_id = get_site(graph, "bench")['id']
+    download_pool = concurrent.futures.ThreadPoolExecutor(args.downloads)
+    parse_pool = ParserPool(args.parsers)
+    cache_dir = tempfile.mkdtemp(prefix="bench-cache-")
+    rng = random.Random(7)
+    questions = [f"How does {rng.choice(TOPICS)} work" for _ in range(args.questions)]
+
+    print(f"{args.files} files of ~{args.size} characters ({args.formats}), {args.latency:.0f} ms per round trip\n")
+    print(f"{'phase':<22} {'ops':>6} {'p50 ms':>9} {'p95 ms':>9} {'throughput':>12} {'':<10} {'peak MB':>9}")
+    try:
+        # Every folder once on a cold tree, then again on the warm one
+        tree = FolderTree(graph, site_id, page_size=ITEMS_PER_PAGE)
+        folders = [""] + tree_paths(tree)
+        measure("list (cold)", lambda path: list_items(FolderTree(graph, site_id), path)[0], folders, "items/s", len)
+        measure("list (warm)", lambda path: list_items(tree, path)[0], folders, "items/s", len)
+
+        index = make_retriever(args.retriever)
+        file_cache = FileCache(cache_dir)
+
+        def ingest(question):
+            indexed = []
+
+            def index_file(file_name, chunks, item):
+                index.add_chunks(file_name, chunks)
+                indexed.append(file_name)
+
+            ingest_search_results(site_id, search_files(site_id, question, graph), graph, file_cache, index_file,
+                                  download_pool, parse_pool, deadline_seconds=300)
+            return len(indexed)
+
+        measure("ingest (cold cache)", ingest, questions, "files/s", lambda files: files)
+        index.clear()
+        measure("ingest (warm cache)", ingest, questions, "files/s", lambda files: files)
+        measure("answer", lambda question: search_answer(question, index, threshold=answer_threshold(args.retriever)),
+                questions, "answers/s")
+    finally:
+        download_pool.shutdown()
+        parse_pool.shutdown()
+        fake.stop()
+        shutil.rmtree(cache_dir, ignore_errors=True)
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+    print(f"\npeak RSS: {usage:.0f} MB, largest parser process: {children:.0f} MB")
+    print(f"Graph round trips: {dict(fake.round_trips)}")
+    print(f"\n{'stage':<12} {'count':>7} {'avg ms':>9} {'MB':>9} {'items':>9}")
+    for stage, stats in sorted(METRICS.snapshot().items()):
+        print(f"{stage:<12} {stats['count']:>7} {stats['seconds'] / stats['count'] * 1000:>9.1f}"
+              f" {stats['bytes'] / 1e6:>9.1f} {stats['items']:>9}")
+
+
+# Every folder path below the root, breadth first
+def tree_paths(tree):
+    paths = []
+    pending = [""]
+    while pending:
+        path = pending.pop(0)
+        items, _, _ = tree.children(path, float("inf"))
+        for item in items or []:
+            if 'folder' in item:
+                child = f"{path}/{item['name']}".lstrip("/")
+                paths.append(child)
+                pending.append(child)
+    return paths
+
+
+if __name__ == "__main__":
+    main()
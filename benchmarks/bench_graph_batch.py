@@ -0,0 +1,47 @@
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_graph import FakeGraph
+from graph_client import GraphClient
+
+FOLDERS = 20
+FILES_PER_FOLDER = 5
+LATENCY = 0.02
+
+
+def measure(fake, label, fetch):
+    before = fake.total_round_trips()
+    start = time.perf_counter()
+    results = fetch()
+    elapsed = time.perf_counter() - start
+    ok = sum(1 for result in results if result is not None)
+    print(f"{label:<40} {fake.total_round_trips() - before:>12} {elapsed * 1000:>10.1f} {ok:>6}")
+
+
+def main():
+    fake = FakeGraph(latency=LATENCY).start()
+    site_id = fake.add_site("Bench")
+    folder_ids = []
+    file_ids = []
+    for folder in range(FOLDERS):
+        folder_ids.append(fake.add_folder(site_id, f"folder{folder}"))
+        for number in range(FILES_PER_FOLDER):
+            file_ids.append(fake.add_file(site_id, f"folder{folder}/file{number}.txt", b"hello world"))
+    graph = GraphClient(base_url=fake.url("/v1.0"))
+
+    metadata_urls = [f"/sites/{site_id}/drive/items/{item_id}" for item_id in file_ids[:20]]
+    children_urls = [f"/sites/{site_id}/drive/items/{item_id}/children" for item_id in folder_ids]
+
+    print(f"{'operation':<40} {'round trips':>12} {'ms':>10} {'ok':>6}")
+    measure(fake, "search hit metadata, one GET each", lambda: [graph.get_json(url) for url in metadata_urls])
+    measure(fake, "search hit metadata, $batch", lambda: [body for status, body in graph.batch(metadata_urls) if status == 200])
+    measure(fake, "sibling folder listings, one GET each", lambda: [graph.get_json(url) for url in children_urls])
+    measure(fake, "sibling folder listings, $batch", lambda: [body for status, body in graph.batch(children_urls) if status == 200])
+    fake.stop()
+
+
+if __name__ == "__main__":
+    main()
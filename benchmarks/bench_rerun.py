@@ -0,0 +1,137 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_graph import FakeGraph
+from synthetic_files import build_site
+
+APP = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "final.py")
+
+
+# Stands in for Azure AD so the app can sign in without a network; tokens never expire here.
+# Like the real client, creating one costs a round trip (MSAL's tenant discovery)
+class FakeSignIn:
+    latency = 0.0
+
+    def __init__(self, *args, **kwargs):
+        time.sleep(self.latency)
+
+    def get_authorization_request_url(self, scopes, **kwargs):
+        return "http://localhost/authorize"
+
+    def acquire_token_by_authorization_code(self, code, scopes, **kwargs):
+        return {"access_token": "token", "expires_in": 3600, "id_token_claims": {"oid": "bench", "tid": "bench"}}
+
+    def get_accounts(self, **kwargs):
+        return []
+
+    def acquire_token_silent(self, *args, **kwargs):
+        return None
+
+
+# Runs in a fresh interpreter: signs in, opens the site, then reruns the unchanged page
+def session(args):
+    # The app's own modules, not this checkout's, when measuring another copy of it
+    sys.path.insert(0, os.path.dirname(os.path.abspath(args.app)))
+    import msal
+    msal.ConfidentialClientApplication = FakeSignIn
+    FakeSignIn.latency = args.latency / 1000
+    from streamlit.testing.v1 import AppTest
+
+    state_dir = tempfile.mkdtemp(prefix="bench-rerun-")
+    app = AppTest.from_file(args.app, default_timeout=120)
+    for name in ("CLIENT_ID", "CLIENT_SECRET", "TENANT_ID", "URL"):
+        app.secrets[name] = "bench"
+    app.secrets["GRAPH_URL"] = args.graph_url
+    for name in ("TOKEN_CACHE_DIR", "FILE_CACHE_DIR", "MIRROR_DIR"):
+        app.secrets[name] = os.path.join(state_dir, name.lower())
+    app.session_state.auth_code = "bench"
+
+    timings = {}
+    start = time.perf_counter()
+    app.run()
+    timings["first run"] = time.perf_counter() - start
+    timings["cold start"] = time.time() - args.spawned_at
+    start = time.perf_counter()
+    app.text_input[1].input("bench").run()
+    timings["open site"] = time.perf_counter() - start
+    reruns = []
+    script_seconds = []
+    for _ in range(args.reruns):
+        before = script_time()
+        start = time.perf_counter()
+        app.run()
+        reruns.append(time.perf_counter() - start)
+        script_seconds.append(script_time() - before)
+    timings["reruns"] = reruns
+    timings["script"] = script_seconds
+    timings["errors"] = [exception.message for exception in app.exception]
+    print(json.dumps(timings))
+
+
+# Seconds the app's script has spent running, from its own "rerun" timings; AppTest's
+# polling for the run to finish is excluded
+def script_time():
+    from metrics import METRICS
+    return METRICS.snapshot().get("rerun", {}).get("seconds", 0.0)
+
+
+def percentiles(latencies):
+    latencies = sorted(latencies)
+    return statistics.median(latencies), latencies[max(int(len(latencies) * 0.95) - 1, 0)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold start and rerun time of the Streamlit app against a fake Graph server")
+    parser.add_argument("--app", default=APP, help="script to measure, e.g. an older checkout of final.py")
+    parser.add_argument("--files", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=20, help="milliseconds added to every Graph round trip")
+    parser.add_argument("--starts", type=int, default=3, help="cold starts, each in a new interpreter")
+    parser.add_argument("--reruns", type=int, default=20, help="unchanged reruns per start")
+    parser.add_argument("--session", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--graph-url", help=argparse.SUPPRESS)
+    parser.add_argument("--spawned-at", type=float, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.session:
+        session(args)
+        return
+
+    fake = FakeGraph(latency=args.latency / 1000).start()
+    build_site(fake, "bench", args.files, ["txt"], 2000)
+    results = []
+    try:
+        for _ in range(args.starts):
+            round_trips = sum(fake.round_trips.values())
+            output = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--session", "--app", args.app, "--reruns", str(args.reruns), "--latency", str(args.latency),
+                 "--graph-url", fake.url("/v1.0"), "--spawned-at", str(time.time())],
+                capture_output=True, text=True, check=True).stdout
+            results.append(json.loads(output.strip().splitlines()[-1]))
+            results[-1]["round trips"] = sum(fake.round_trips.values()) - round_trips
+    finally:
+        fake.stop()
+
+    print(f"{args.app}: {args.files} files, {args.latency:.0f} ms per round trip\n")
+    print(f"{'phase':<28} {'p50 ms':>9} {'p95 ms':>9}")
+    for phase in ("cold start", "first run", "open site"):
+        p50, p95 = percentiles([result[phase] for result in results])
+        print(f"{phase + ' (new interpreter)' if phase == 'cold start' else phase:<28} {p50 * 1000:>9.1f} {p95 * 1000:>9.1f}")
+    p50, p95 = percentiles([rerun for result in results for rerun in result["reruns"]])
+    print(f"{'unchanged rerun':<28} {p50 * 1000:>9.1f} {p95 * 1000:>9.1f}")
+    p50, p95 = percentiles([seconds for result in results for seconds in result["script"]])
+    print(f"{'  of which in the script':<28} {p50 * 1000:>9.1f} {p95 * 1000:>9.1f}")
+    print(f"\nGraph round trips per session: {[result['round trips'] for result in results]}")
+    errors = [error for result in results for error in result["errors"]]
+    if errors:
+        print(f"app errors: {errors}")
+
+
+if __name__ == "__main__":
+    main()
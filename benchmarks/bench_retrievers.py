@@ -0,0 +1,91 @@
+import itertools
+import os
+import random
+import statistics
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_search_index import VOCABULARY_SIZE, make_document, make_sentence, make_vocabulary
+from embedding_index import STOP_WORDS
+from retrievers import RETRIEVERS, make_retriever
+from search_index import tokenize
+
+QUESTIONS = 50
+
+
+def percentiles(latencies):
+    latencies = sorted(latencies)
+    return statistics.median(latencies), latencies[int(len(latencies) * 0.95) - 1]
+
+
+# The embedding index's top k by a plain scan of every stored vector, to check its feature scan against
+def dense_top(index, question, top_k=10):
+    counts = {}
+    for term in tokenize(question):
+        if term not in STOP_WORDS:
+            counts[term] = counts.get(term, 0) + 1
+    if not counts:
+        return set()
+    scores = np.concatenate([np.asarray(block).T @ index.embed(counts, idf=True) for block in index.blocks])
+    best = np.argsort(-scores[:index.next_row])[:top_k]
+    return {index.rows[int(row)][0] for row in best if scores[row] > 0 and int(row) in index.rows}
+
+
+# A question made from a few words of an indexed sentence, inflected so none of them match exactly
+def inflected_question(rng, sentence):
+    words = rng.sample(sentence.split(), 6)
+    return " ".join(word + rng.choice(("s", "ed", "ing")) for word in words)
+
+
+def main(sizes=(10, 100, 1000, 5000)):
+    rng = random.Random(42)
+    vocabulary = make_vocabulary(rng)
+    weights = list(itertools.accumulate(1.0 / rank for rank in range(1, VOCABULARY_SIZE + 1)))
+    indexes = {name: make_retriever(name) for name in RETRIEVERS}
+
+    documents = []
+    ingest = {}
+    print(f"{'retriever':>10} {'docs':>6} {'sentences':>10} {'ingest/doc ms':>14} {'p50 ms':>8} {'p95 ms':>8}"
+          f" {'inflected hit@10':>17} {'recall@10':>10}")
+    for size in sizes:
+        added = []
+        while len(documents) < size:
+            added.append((f"doc{len(documents)}.txt", make_document(rng, vocabulary, weights)))
+            documents.append(added[-1])
+        for name, index in indexes.items():
+            start = time.perf_counter()
+            for doc_name, content in added:
+                index.add_document(doc_name, content)
+            ingest[name] = (time.perf_counter() - start) / max(len(added), 1)
+
+        questions = [make_sentence(rng, vocabulary, weights)[:80] for _ in range(QUESTIONS)]
+        sources = [rng.choice(rng.choice(documents)[1].split(". ")).rstrip(".") for _ in range(QUESTIONS)]
+        inflected = [inflected_question(rng, source) for source in sources]
+        for name, index in indexes.items():
+            latencies = []
+            for question in questions:
+                start = time.perf_counter()
+                index.search(question, top_k=20)
+                latencies.append(time.perf_counter() - start)
+            p50, p95 = percentiles(latencies)
+            hits = sum(any(sentence == source for _, sentence, _ in index.search(question, top_k=10))
+                       for question, source in zip(inflected, sources))
+            # Share of the exact top 10 that the embedding index's search returns
+            recall = ""
+            if name == "embedding":
+                found = expected = 0
+                for question in questions:
+                    truth = dense_top(index, question)
+                    found += len(truth & {sentence for _, sentence, _ in index.search(question, top_k=10)})
+                    expected += len(truth)
+                recall = f"{found / max(expected, 1):.2f}"
+            print(f"{name:>10} {size:>6} {len(index):>10} {ingest[name] * 1000:>14.2f} {p50 * 1000:>8.2f} {p95 * 1000:>8.2f}"
+                  f" {hits / QUESTIONS:>17.2f} {recall:>10}")
+
+
+if __name__ == "__main__":
+    main()
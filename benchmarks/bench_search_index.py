@@ -0,0 +1,79 @@
+import itertools
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from search_index import SentenceIndex
+
+VOCABULARY_SIZE = 50000
+SENTENCES_PER_DOC = 20
+WORDS_PER_SENTENCE = 15
+QUESTIONS = 50
+
+
+def make_vocabulary(rng):
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    return ["".join(rng.choice(letters) for _ in range(rng.randint(3, 9))) for _ in range(VOCABULARY_SIZE)]
+
+
+def make_sentence(rng, vocabulary, weights):
+    return " ".join(rng.choices(vocabulary, cum_weights=weights, k=WORDS_PER_SENTENCE))
+
+
+def make_document(rng, vocabulary, weights):
+    return ". ".join(make_sentence(rng, vocabulary, weights) for _ in range(SENTENCES_PER_DOC)) + "."
+
+
+def main(sizes=(10, 100, 1000, 10000)):
+    rng = random.Random(42)
+    vocabulary = make_vocabulary(rng)
+    # Zipf-like term frequencies, as in natural text
+    weights = list(itertools.accumulate(1.0 / rank for rank in range(1, VOCABULARY_SIZE + 1)))
+
+    index = SentenceIndex()
+    documents = 0
+    print(f"{'docs':>8} {'sentences':>10} {'ingest/doc ms':>14} {'first p50':>10} {'p50 ms':>8} {'p95 ms':>8}"
+          f" {'recall':>7}")
+    for size in sizes:
+        start = time.perf_counter()
+        added = size - documents
+        while documents < size:
+            index.add_document(f"doc{documents}.txt", make_document(rng, vocabulary, weights))
+            documents += 1
+        ingest = (time.perf_counter() - start) / max(added, 1)
+
+        # The first pass over the questions also computes the norms of the sentences added since
+        # the last size; the second shows the steady state
+        questions = [make_sentence(rng, vocabulary, weights)[:80] for _ in range(QUESTIONS)]
+        first = statistics.median(time_questions(index, questions))
+        latencies = sorted(time_questions(index, questions))
+        p50 = statistics.median(latencies)
+        p95 = latencies[int(len(latencies) * 0.95) - 1]
+        # Share of the exact top 20 (every matching sentence scored) that the budgeted search returns
+        found = expected = 0
+        for question in questions:
+            results = {sentence for _, sentence, _ in index.search(question, top_k=20, threshold=0.2)}
+            budget, index.candidate_budget = index.candidate_budget, float("inf")
+            best = {sentence for _, sentence, _ in index.search(question, top_k=20, threshold=0.2)}
+            index.candidate_budget = budget
+            found += len(results & best)
+            expected += len(best)
+        print(f"{size:>8} {len(index):>10} {ingest * 1000:>14.2f} {first * 1000:>10.2f} {p50 * 1000:>8.2f}"
+              f" {p95 * 1000:>8.2f} {found / max(expected, 1):>7.2f}")
+
+
+def time_questions(index, questions):
+    latencies = []
+    for question in questions:
+        start = time.perf_counter()
+        index.search(question, top_k=20, threshold=0.2)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+if __name__ == "__main__":
+    main()
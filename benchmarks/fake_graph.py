@@ -0,0 +1,263 @@
+import collections
+import http.server
+import json
+import re
+import threading
+import time
+import urllib.parse
+
+
+class FakeGraph:
+    # Local stand-in for the parts of Microsoft Graph the app uses. Serves one drive per site
+    # from an in-memory tree and counts every HTTP round trip so benchmarks can compare them.
+
+    def __init__(self, latency=0.0, page_size=200):
+        self.latency = latency
+        self.page_size = page_size
+        self.sites = {}
+        self.items = {}
+        self.next_id = 0
+        self.seq = 0
+        self.tombstones = []
+        self.round_trips = collections.Counter()
+        self.lock = threading.Lock()
+        self.server = None
+
+    # -- building the tree
+
+    def add_site(self, name):
+        site_id = f"site-{len(self.sites) + 1}"
+        root = self.new_item(site_id, None, "root", folder=True)
+        self.sites[site_id] = {"id": site_id, "name": name, "root": root["id"],
+                               "webUrl": f"https://fake.sharepoint.com/sites/{name}"}
+        return site_id
+
+    def new_item(self, site_id, parent_id, name, folder=False, content=b"", text=None):
+        with self.lock:
+            self.next_id += 1
+            self.seq += 1
+            item_id = f"item-{self.next_id}"
+        item = {"id": item_id, "site": site_id, "parent": parent_id, "name": name, "folder": folder,
+                "content": content, "text": text, "version": 1, "seq": self.seq, "children": []}
+        self.items[item_id] = item
+        if parent_id:
+            self.items[parent_id]["children"].append(item_id)
+        return item
+
+    def add_folder(self, site_id, path):
+        parent = self.items[self.sites[site_id]["root"]]
+        for name in [part for part in path.split("/") if part]:
+            existing = [self.items[child] for child in parent["children"] if self.items[child]["name"] == name]
+            parent = existing[0] if existing else self.new_item(site_id, parent["id"], name, folder=True)
+        return parent["id"]
+
+    # `text` is what search matches for binary formats; by default it is the content itself
+    def add_file(self, site_id, path, content, text=None):
+        folder_path, _, name = path.rpartition("/")
+        parent_id = self.add_folder(site_id, folder_path)
+        return self.new_item(site_id, parent_id, name, content=content, text=text)["id"]
+
+    def update_file(self, item_id, content):
+        item = self.items[item_id]
+        item["content"] = content
+        item["version"] += 1
+        with self.lock:
+            self.seq += 1
+            item["seq"] = self.seq
+
+    def delete_item(self, item_id):
+        for child in list(self.items[item_id]["children"]):
+            self.delete_item(child)
+        item = self.items.pop(item_id)
+        self.items[item["parent"]]["children"].remove(item_id)
+        with self.lock:
+            self.seq += 1
+            self.tombstones.append({"id": item_id, "site": item["site"], "seq": self.seq})
+
+    # -- serving
+
+    def url(self, path=""):
+        return f"http://127.0.0.1:{self.server.server_address[1]}{path}"
+
+    def start(self):
+        fake = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def respond(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = json.loads(self.rfile.read(length)) if length else None
+                status, headers, payload = fake.handle(self.command, self.path, body, count=True)
+                if isinstance(payload, (dict, list)):
+                    payload = json.dumps(payload).encode()
+                    headers = dict(headers, **{"Content-Type": "application/json"})
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            do_GET = respond
+            do_POST = respond
+
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def total_round_trips(self):
+        return sum(self.round_trips.values())
+
+    def metadata(self, item):
+        data = {"id": item["id"], "name": item["name"], "eTag": f"\"{item['id']},{item['version']}\"",
+                "cTag": f"\"c:{item['id']},{item['version']}\"",
+                "parentReference": {"id": item["parent"]}}
+        if item["parent"]:
+            parent_path = self.item_path(self.items[item["parent"]])
+            data["parentReference"]["path"] = "/drive/root:" + (f"/{parent_path}" if parent_path else "")
+        else:
+            data["root"] = {}
+        if item["folder"]:
+            data["folder"] = {"childCount": len(item["children"])}
+        else:
+            data["file"] = {}
+            data["size"] = len(item["content"])
+            data["@microsoft.graph.downloadUrl"] = self.url(f"/download/{item['id']}")
+        return data
+
+    def item_path(self, item):
+        parts = []
+        while item["parent"]:
+            parts.append(item["name"])
+            item = self.items[item["parent"]]
+        return "/".join(reversed(parts))
+
+    def resolve_path(self, site_id, path):
+        item = self.items[self.sites[site_id]["root"]]
+        for name in [part for part in urllib.parse.unquote(path).split("/") if part]:
+            matches = [self.items[child] for child in item["children"] if self.items[child]["name"] == name]
+            if not matches:
+                return None
+            item = matches[0]
+        return item
+
+    def page(self, values, path, query):
+        top = int(query.get("$top", [self.page_size])[0])
+        skip = int(query.get("$skiptoken", [0])[0])
+        page = {"value": values[skip:skip + top]}
+        if skip + top < len(values):
+            query = dict(query, **{"$skiptoken": [str(skip + top)], "$top": [str(top)]})
+            page["@odata.nextLink"] = self.url(f"/v1.0{path}?{urllib.parse.urlencode(query, doseq=True)}")
+        return page
+
+    def handle(self, method, raw_path, body=None, count=False):
+        parts = urllib.parse.urlsplit(raw_path)
+        path, query = parts.path, urllib.parse.parse_qs(parts.query)
+        if count:
+            kind = "batch" if path.endswith("$batch") else "download" if path.startswith("/download/") else "graph"
+            with self.lock:
+                self.round_trips[kind] += 1
+            if self.latency:
+                time.sleep(self.latency)
+        if path.startswith("/download/"):
+            item = self.items.get(path[len("/download/"):])
+            if item is None:
+                return 404, {}, b""
+            return 200, {"Content-Type": "application/octet-stream"}, item["content"]
+        if not path.startswith("/v1.0"):
+            return 404, {}, b""
+        path = path[len("/v1.0"):]
+
+        if method == "POST" and path == "/$batch":
+            responses = []
+            for request in body.get("requests", []):
+                status, headers, payload = self.handle(request.get("method", "GET"), "/v1.0" + request["url"])
+                if not isinstance(payload, (dict, list)):
+                    payload = {}
+                responses.append({"id": request["id"], "status": status, "headers": headers, "body": payload})
+            return 200, {}, {"responses": responses}
+
+        if path == "/sites":
+            return 200, {}, {"value": [dict(site, root=None) for site in self.sites.values()]}
+
+        match = re.fullmatch(r"/sites/[^/]+:/sites/([^/]+)", path)
+        if match:
+            name = urllib.parse.unquote(match.group(1))
+            for site in self.sites.values():
+                if site["name"] == name:
+                    return 200, {}, {"id": site["id"], "name": site["name"], "webUrl": site["webUrl"]}
+            return 404, {}, {"error": {"code": "itemNotFound"}}
+
+        match = re.fullmatch(r"/sites/([^/]+)/drive/(.*)", path)
+        if not match or match.group(1) not in self.sites:
+            return 404, {}, {"error": {"code": "itemNotFound"}}
+        site_id, rest = match.groups()
+
+        if rest == "root/delta":
+            token = int(query.get("token", [0])[0])
+            changes = sorted((item for item in self.items.values() if item["site"] == site_id and item["seq"] > token),
+                             key=lambda item: item["seq"])
+            values = [self.metadata(item) for item in changes]
+            # Like Graph's, delta items only name their parent's id, not its path
+            for value in values:
+                value["parentReference"].pop("path", None)
+            if token:
+                values += [{"id": tombstone["id"], "deleted": {"state": "deleted"}}
+                           for tombstone in self.tombstones if tombstone["site"] == site_id and tombstone["seq"] > token]
+            page = self.page(values, path, query)
+            if "@odata.nextLink" not in page:
+                page["@odata.deltaLink"] = self.url(f"/v1.0{path}?token={self.seq}")
+            return 200, {}, page
+
+        if rest == "root":
+            return 200, {}, self.metadata(self.items[self.sites[site_id]["root"]])
+        match = re.fullmatch(r"root:/([^:]*):?", rest)
+        if match:
+            item = self.resolve_path(site_id, match.group(1))
+            if item is None:
+                return 404, {}, {"error": {"code": "itemNotFound"}}
+            return 200, {}, self.metadata(item)
+        if rest == "root/children":
+            item = self.items[self.sites[site_id]["root"]]
+            rest = f"items/{item['id']}/children"
+        match = re.fullmatch(r"root:/(.*):/(children|content)", rest)
+        if match:
+            item = self.resolve_path(site_id, match.group(1))
+            if item is None:
+                return 404, {}, {"error": {"code": "itemNotFound"}}
+            if match.group(2) == "content":
+                return 200, {"Content-Type": "application/octet-stream"}, item["content"]
+            rest = f"items/{item['id']}/children"
+        match = re.fullmatch(r"items/([^/]+)(/children|/content)?", rest)
+        if match:
+            item = self.items.get(match.group(1))
+            if item is None:
+                return 404, {}, {"error": {"code": "itemNotFound"}}
+            if match.group(2) == "/content":
+                return 200, {"Content-Type": "application/octet-stream"}, item["content"]
+            if match.group(2):
+                values = [self.metadata(self.items[child]) for child in item["children"]]
+                return 200, {}, self.page(values, path, query)
+            return 200, {}, self.metadata(item)
+        match = re.fullmatch(r"root/search\(q='(.*)'\)", urllib.parse.unquote(rest))
+        if match:
+            words = [word.lower() for word in match.group(1).split() if len(word) > 2]
+            values = []
+            for item in self.items.values():
+                if item["site"] != site_id or item["folder"]:
+                    continue
+                text = (item["name"] + " " + (item["text"] or item["content"][:4096].decode("utf-8", "ignore"))[:4096]).lower()
+                if any(word in text for word in words):
+                    values.append(self.metadata(item))
+            return 200, {}, self.page(values, path, query)
+        return 404, {}, {"error": {"code": "itemNotFound"}}
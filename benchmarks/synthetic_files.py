@@ -0,0 +1,105 @@
+import csv
+import io
+import random
+
+import docx
+
+TOPICS = ["holiday", "payroll", "revenue", "security", "onboarding", "travel", "pension", "inventory",
+          "compliance", "marketing", "recruiting", "training", "benefits", "procurement", "warranty", "support"]
+
+FILLER = ("the team reviewed each report and agreed that the process should continue with small changes "
+          "while the office prepared new guidance for every department across all regional sites").split()
+
+
+# A sentence about a topic, so questions naming the topic have something to find
+def make_sentence(rng, topic):
+    words = rng.sample(FILLER, 12)
+    words.insert(rng.randrange(len(words)), topic)
+    return " ".join(words).capitalize() + "."
+
+
+def make_paragraphs(rng, topic, size):
+    paragraphs = []
+    while sum(len(paragraph) for paragraph in paragraphs) < size:
+        paragraphs.append(" ".join(make_sentence(rng, topic) for _ in range(5)))
+    return paragraphs
+
+
+def escape_pdf(text):
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+# A plain-text PDF in Helvetica, wrapped at 90 characters and 40 lines to a page
+def make_pdf(paragraphs):
+    lines = [paragraph[i:i + 90] for paragraph in paragraphs for i in range(0, len(paragraph), 90)]
+    pages = [lines[i:i + 40] for i in range(0, len(lines), 40)] or [[]]
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None, "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for page in pages:
+        stream = "BT /F1 10 Tf 40 800 Td 14 TL " + " ".join(f"({escape_pdf(line)}) '" for line in page) + " ET"
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 842] "
+                       f"/Resources << /Font << /F1 3 0 R >> >> /Contents {len(objects)} 0 R >>")
+        kids.append(f"{len(objects)} 0 R")
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(kids)} >>"
+    out = io.BytesIO()
+    out.write(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(out.tell())
+        out.write(f"{number} 0 obj\n{body}\nendobj\n".encode("latin-1"))
+    xref = out.tell()
+    out.write(f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode())
+    for offset in offsets:
+        out.write(f"{offset:010d} 00000 n \n".encode())
+    out.write(f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode())
+    return out.getvalue()
+
+
+def make_docx(paragraphs):
+    document = docx.Document()
+    for paragraph in paragraphs:
+        document.add_paragraph(paragraph)
+    out = io.BytesIO()
+    document.save(out)
+    return out.getvalue()
+
+
+def make_csv(paragraphs):
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(["id", "note"])
+    for number, paragraph in enumerate(paragraphs):
+        for sentence in paragraph.split(". "):
+            writer.writerow([number, sentence])
+    return out.getvalue().encode("utf-8")
+
+
+def make_txt(paragraphs):
+    return "\n".join(paragraphs).encode("utf-8")
+
+
+MAKERS = {"pdf": make_pdf, "docx": make_docx, "csv": make_csv, "txt": make_txt}
+
+
+# Returns (file name, content, searchable text) for a file of about `size` characters of text
+def make_file(rng, number, file_format, size):
+    topic = rng.choice(TOPICS)
+    paragraphs = make_paragraphs(rng, topic, size)
+    return f"{topic}-{number}.{file_format}", MAKERS[file_format](paragraphs), " ".join(paragraphs)
+
+
+def build_site(fake, name, files, formats, size, folders=4, depth=2, seed=1):
+    rng = random.Random(seed)
+    site_id = fake.add_site(name)
+    paths = [""]
+    level = [""]
+    for _ in range(depth):
+        level = [f"{path}/dept{i}".lstrip("/") for path in level for i in range(folders)]
+        paths += level
+    for path in paths[1:]:
+        fake.add_folder(site_id, path)
+    for number in range(files):
+        file_name, content, text = make_file(rng, number, formats[number % len(formats)], size)
+        fake.add_file(site_id, f"{rng.choice(paths)}/{file_name}".lstrip("/"), content, text=text)
+    return site_id, paths
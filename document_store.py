@@ -0,0 +1,147 @@
+import collections
+import threading
+import weakref
+import zlib
+
+
+class DocumentStore:
+    # Extracted text of drive items shared by all sessions. Each item's text is stored once,
+    # zlib-compressed and keyed by item id + eTag, however many sessions index it. Past
+    # max_bytes of compressed text the least recently used entries are dropped, those no
+    # session holds first; a dropped entry is read again from the file cache when needed.
+    # The sessions' search indexes, which hold far more than the text, share index_max_bytes.
+
+    def __init__(self, max_bytes=200 * 1024 * 1024, index_max_bytes=None):
+        self.max_bytes = max_bytes
+        self.index_max_bytes = index_max_bytes
+        self.lock = threading.Lock()
+        self.counters = collections.Counter()
+        # item id -> [etag, name, compressed text]
+        self.entries = collections.OrderedDict()
+        self.holders = {}
+        self.bytes = 0
+        self.sessions = weakref.WeakSet()
+
+    def get(self, item_id, etag):
+        with self.lock:
+            entry = self.entries.get(item_id)
+            if entry is None or not etag or entry[0] != etag:
+                self.counters["misses"] += 1
+                return None
+            self.entries.move_to_end(item_id)
+            self.counters["hits"] += 1
+            return entry[1], zlib.decompress(entry[2]).decode("utf-8")
+
+    def put(self, item_id, etag, name, text, holder=None):
+        with self.lock:
+            entry = self.entries.get(item_id)
+            if entry is None or entry[0] != etag or not etag:
+                data = zlib.compress(text.encode("utf-8"), 6)
+                if entry is not None:
+                    self.bytes -= len(entry[2])
+                self.entries[item_id] = [etag, name, data]
+                self.bytes += len(data)
+            self.entries.move_to_end(item_id)
+            if holder is not None:
+                self.holders.setdefault(item_id, weakref.WeakSet()).add(holder)
+            self.evict(keep=item_id)
+
+    def release(self, item_id, holder):
+        with self.lock:
+            holders = self.holders.get(item_id)
+            if holders is not None:
+                holders.discard(holder)
+                if not holders:
+                    del self.holders[item_id]
+
+    def held(self, item_id):
+        return bool(self.holders.get(item_id))
+
+    # Bytes held by the search indexes of all live sessions
+    def index_bytes(self):
+        with self.lock:
+            sessions = list(self.sessions)
+        return sum(session.bytes for session in sessions)
+
+    def index_over_budget(self):
+        return self.index_max_bytes is not None and self.index_bytes() > self.index_max_bytes
+
+    def evict(self, keep=None):
+        for only_unheld in (True, False):
+            for item_id in list(self.entries):
+                if self.bytes <= self.max_bytes:
+                    return
+                if item_id == keep or (only_unheld and self.held(item_id)):
+                    continue
+                self.bytes -= len(self.entries.pop(item_id)[2])
+                self.holders.pop(item_id, None)
+                self.counters["evictions"] += 1
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters)
+            stats["documents"] = len(self.entries)
+            stats["bytes"] = self.bytes
+        stats["index_bytes"] = self.index_bytes()
+        for key in ("hits", "misses", "evictions"):
+            stats.setdefault(key, 0)
+        return stats
+
+
+class SessionDocuments:
+    # The documents one session has indexed, as references into the shared store, with an LRU
+    # budget of max_bytes held by the session's search index for them. Past it, or past the
+    # store's index_max_bytes for all sessions together, the session's least recently used
+    # documents are passed to on_evict(name), which drops them from the index; a later question
+    # that needs them indexes them again.
+
+    def __init__(self, store, max_bytes=256 * 1024 * 1024, on_evict=None):
+        self.store = store
+        self.max_bytes = max_bytes
+        self.on_evict = on_evict
+        # item id -> (etag, name, index size)
+        self.documents = collections.OrderedDict()
+        self.bytes = 0
+        self.evictions = 0
+        with store.lock:
+            store.sessions.add(self)
+
+    def __len__(self):
+        return len(self.documents)
+
+    # Whether this session already indexed the item at this eTag, marking it recently used
+    def touch(self, item_id, etag):
+        document = self.documents.get(item_id)
+        if document is None or not etag or document[0] != etag:
+            return False
+        self.documents.move_to_end(item_id)
+        return True
+
+    # index_bytes is what the session's index holds for the document once indexed
+    def add(self, item_id, etag, name, text, index_bytes):
+        self.discard(item_id)
+        # The index keys documents by name, so another item with this name was just replaced
+        for other_id, (_, other_name, _) in list(self.documents.items()):
+            if other_name == name:
+                self.discard(other_id)
+        self.store.put(item_id, etag, name, text, self)
+        self.documents[item_id] = (etag, name, index_bytes)
+        self.bytes += index_bytes
+        while len(self.documents) > 1 and (self.bytes > self.max_bytes or self.store.index_over_budget()):
+            oldest = next(iter(self.documents))
+            name = self.documents[oldest][1]
+            self.discard(oldest)
+            self.evictions += 1
+            if self.on_evict:
+                self.on_evict(name)
+
+    def discard(self, item_id):
+        document = self.documents.pop(item_id, None)
+        if document is not None:
+            self.bytes -= document[2]
+            self.store.release(item_id, self)
+
+    def clear(self):
+        for item_id in list(self.documents):
+            self.discard(item_id)
+        self.evictions = 0
@@ -0,0 +1,255 @@
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+
+from extract import iter_text_chunks
+
+# Bumped when the tables change; a mirror with another version is crawled again from scratch
+SCHEMA_VERSION = 2
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS items (
+    id TEXT PRIMARY KEY,
+    parent_id TEXT,
+    name TEXT NOT NULL,
+    is_folder INTEGER NOT NULL,
+    etag TEXT,
+    size INTEGER,
+    last_modified TEXT,
+    text_etag TEXT
+);
+CREATE INDEX IF NOT EXISTS items_parent ON items (parent_id, name);
+CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT);
+CREATE VIRTUAL TABLE IF NOT EXISTS texts USING fts5 (item_id UNINDEXED, name, body);
+"""
+
+# An item and everything below it
+SUBTREE = """
+WITH RECURSIVE subtree (id) AS (
+    SELECT ? UNION SELECT items.id FROM items JOIN subtree ON items.parent_id = subtree.id
+)
+SELECT id FROM subtree
+"""
+
+
+class DriveMirror:
+    # Local SQLite mirror of a site's drive, kept current with the Graph /delta endpoint.
+    # Holds item metadata plus a full-text index of extracted file text, so browsing and
+    # question answering can run without Graph calls. Items are kept by id under their
+    # parent's id, as /delta reports them without paths; a move or rename is one row. The
+    # delta link (or the next page link of an unfinished crawl) is persisted, so a restart
+    # resumes where it left off.
+
+    def __init__(self, db_path, graph, site_id, file_cache=None, max_file_bytes=50 * 1024 * 1024, extract_limits=None):
+        self.graph = graph
+        self.site_id = site_id
+        self.file_cache = file_cache
+        self.max_file_bytes = max_file_bytes
+        self.extract_limits = extract_limits or {}
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self.db = sqlite3.connect(db_path, check_same_thread=False)
+        if self.db.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+            self.db.executescript("DROP TABLE IF EXISTS items; DROP TABLE IF EXISTS texts; DROP TABLE IF EXISTS state;")
+            self.db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        self.db.executescript(SCHEMA)
+        self.lock = threading.RLock()
+        self.sync_lock = threading.Lock()
+        self.thread = None
+        self.stop_event = threading.Event()
+        self.idle_timeout = None
+        self.used_at = time.time()
+        self.last_sync = None
+        self.last_error = None
+
+    # -- state
+
+    def get_state(self, key):
+        with self.lock:
+            row = self.db.execute("SELECT value FROM state WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_state(self, key, value):
+        self.db.execute("INSERT OR REPLACE INTO state (key, value) VALUES (?, ?)", (key, value))
+
+    # Whether a first crawl has finished and its files' text is indexed, so questions can be
+    # answered from the mirror
+    def is_ready(self):
+        return self.get_state("ready") is not None
+
+    # -- syncing
+
+    def sync(self):
+        with self.sync_lock:
+            return self.sync_changes()
+
+    def sync_changes(self):
+        url = (self.get_state("next_link") or self.get_state("delta_link")
+               or f"https://graph.microsoft.com/v1.0/sites/{self.site_id}/drive/root/delta")
+        changed = 0
+        while url and not self.stopping():
+            response = self.graph.get(url)
+            if response.status_code == 410:
+                # The delta token expired; Graph wants a full re-crawl
+                with self.lock, self.db:
+                    self.db.execute("DELETE FROM state WHERE key IN ('next_link', 'delta_link')")
+                url = f"https://graph.microsoft.com/v1.0/sites/{self.site_id}/drive/root/delta"
+                continue
+            if response.status_code != 200:
+                raise RuntimeError(f"Delta sync failed with HTTP {response.status_code}")
+            page = response.json()
+            with self.lock, self.db:
+                for item in page.get('value', []):
+                    changed += self.apply(item)
+                if '@odata.nextLink' in page:
+                    self.set_state("next_link", page['@odata.nextLink'])
+                else:
+                    self.db.execute("DELETE FROM state WHERE key = 'next_link'")
+                    self.set_state("delta_link", page.get('@odata.deltaLink'))
+            url = page.get('@odata.nextLink')
+        if self.index_texts():
+            with self.lock, self.db:
+                self.set_state("ready", "1")
+        self.last_sync = time.time()
+        return changed
+
+    def apply(self, item):
+        if 'root' in item:
+            self.set_state("root_id", item['id'])
+            return 0
+        if 'deleted' in item:
+            # Graph may not report a deleted folder's children, so they go with it
+            subtree = [(row[0],) for row in self.db.execute(SUBTREE, (item['id'],)).fetchall()]
+            self.db.executemany("DELETE FROM items WHERE id = ?", subtree)
+            self.db.executemany("DELETE FROM texts WHERE item_id = ?", subtree)
+            return 1
+        previous = self.db.execute("SELECT text_etag FROM items WHERE id = ?", (item['id'],)).fetchone()
+        self.db.execute(
+            "INSERT OR REPLACE INTO items (id, parent_id, name, is_folder, etag, size, last_modified, text_etag)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (item['id'], item.get('parentReference', {}).get('id'), item['name'], int('folder' in item), item.get('eTag'),
+             item.get('size'), item.get('lastModifiedDateTime'), previous[0] if previous else None))
+        return 1
+
+    # Extracts the text of every file that changed since it was last indexed. Returns whether
+    # all of them were done, rather than stopped part way
+    def index_texts(self):
+        with self.lock:
+            stale = self.db.execute(
+                "SELECT id, name, etag, size FROM items WHERE is_folder = 0 AND (text_etag IS NULL OR text_etag != etag)").fetchall()
+        for item_id, name, etag, size in stale:
+            if self.stopping():
+                return False
+            text = self.fetch_text(item_id, name, etag, size)
+            with self.lock, self.db:
+                self.db.execute("DELETE FROM texts WHERE item_id = ?", (item_id,))
+                if text:
+                    self.db.execute("INSERT INTO texts (item_id, name, body) VALUES (?, ?, ?)", (item_id, name, text))
+                self.db.execute("UPDATE items SET text_etag = ? WHERE id = ?", (etag, item_id))
+        return True
+
+    def fetch_text(self, item_id, name, etag, size):
+        if size and size > self.max_file_bytes:
+            return ""
+        if self.file_cache is not None:
+            cached = self.file_cache.get(item_id, etag)
+            if cached:
+                return cached[1]
+        with tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024) as f:
+            url = f"https://graph.microsoft.com/v1.0/sites/{self.site_id}/drive/items/{item_id}/content"
+            if self.graph.download(url, f, max_bytes=self.max_file_bytes) is None:
+                return ""
+            f.seek(0)
+            start = time.perf_counter()
+            try:
+                text = ' '.join(iter_text_chunks(f, name, **self.extract_limits))
+            except Exception:
+                text = ""
+            if self.file_cache is not None:
+                self.file_cache.put_file(item_id, etag, name, f, text, time.perf_counter() - start)
+        return text
+
+    # -- background crawling
+
+    # Starts crawling, or resumes a paused crawl, and counts as a use of the mirror. With
+    # idle_timeout, crawling pauses once the mirror hasn't been used for that many seconds,
+    # so nobody's site is crawled on for the life of the process after their sessions are gone
+    def start(self, interval=300, idle_timeout=None):
+        self.idle_timeout = idle_timeout
+        self.used_at = time.time()
+        if self.thread and self.thread.is_alive():
+            return
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.run, args=(interval,), daemon=True)
+        self.thread.start()
+
+    def run(self, interval):
+        while not self.stopping():
+            try:
+                self.sync()
+                self.last_error = None
+            except Exception as e:
+                self.last_error = str(e)
+            self.stop_event.wait(interval)
+
+    def stop(self):
+        self.stop_event.set()
+
+    # Whether crawling should stop: the mirror was stopped, or paused for being idle
+    def stopping(self):
+        return self.stop_event.is_set() or (
+            self.idle_timeout is not None and time.time() - self.used_at > self.idle_timeout)
+
+    # -- local queries
+
+    # Id of the folder at a path, found by walking down from the root one name at a time
+    def folder_id(self, path):
+        folder_id = self.get_state("root_id")
+        for name in [part for part in path.split("/") if part]:
+            if folder_id is None:
+                break
+            row = self.db.execute("SELECT id FROM items WHERE parent_id = ? AND name = ? AND is_folder = 1",
+                                  (folder_id, name)).fetchone()
+            folder_id = row[0] if row else None
+        return folder_id
+
+    def children(self, path=""):
+        with self.lock:
+            folder_id = self.folder_id(path)
+            if folder_id is None:
+                return []
+            rows = self.db.execute(
+                "SELECT id, name, is_folder, etag, size FROM items WHERE parent_id = ? ORDER BY name COLLATE NOCASE",
+                (folder_id,)).fetchall()
+        return [self.as_item(row) for row in rows]
+
+    def search(self, query, limit=25):
+        terms = re.findall(r"\w\w+", query)
+        if not terms:
+            return []
+        match = " OR ".join(f'"{term}"' for term in terms)
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT items.id, items.name, items.is_folder, items.etag, items.size FROM texts"
+                " JOIN items ON items.id = texts.item_id WHERE texts MATCH ? ORDER BY bm25(texts) LIMIT ?",
+                (match, limit)).fetchall()
+        return [self.as_item(row) for row in rows]
+
+    def text(self, item_id):
+        with self.lock:
+            row = self.db.execute("SELECT name, body FROM texts WHERE item_id = ?", (item_id,)).fetchone()
+        return row
+
+    def as_item(self, row):
+        item_id, name, is_folder, etag, size = row
+        item = {'id': item_id, 'name': name, 'eTag': etag, 'size': size}
+        item['folder' if is_folder else 'file'] = {}
+        return item
+
+    def counts(self):
+        with self.lock:
+            files, folders, texts = self.db.execute(
+                "SELECT SUM(is_folder = 0), SUM(is_folder = 1), (SELECT COUNT(*) FROM texts) FROM items").fetchone()
+        return files or 0, folders or 0, texts or 0
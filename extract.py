@@ -0,0 +1,89 @@
+import codecs
+import io
+
+# python-docx, PyPDF2 and pandas are imported by the branch that needs them, so importing this
+# module (as the app does on every cold start) doesn't load them
+
+# Default caps on how much of a single file gets extracted
+MAX_PAGES = 500
+MAX_ROWS = 200000
+MAX_BYTES = 20 * 1024 * 1024
+
+ROWS_PER_CHUNK = 5000
+PARAGRAPHS_PER_CHUNK = 200
+READ_SIZE = 1024 * 1024
+
+
+def iter_text_chunks(file, file_name, max_pages=MAX_PAGES, max_rows=MAX_ROWS, max_bytes=MAX_BYTES):
+    # Yields the text of a binary file object page by page (PDF), paragraph batch by
+    # paragraph batch (DOCX), row batch by row batch (CSV) or block by block (TXT),
+    # stopping once max_bytes of text have been produced
+    remaining = max_bytes
+    for chunk in iter_raw_chunks(file, file_name, max_pages, max_rows):
+        size = len(chunk.encode('utf-8'))
+        if size > remaining:
+            yield chunk.encode('utf-8')[:remaining].decode('utf-8', 'ignore')
+            return
+        remaining -= size
+        yield chunk
+
+
+def iter_raw_chunks(file, file_name, max_pages, max_rows):
+    if file_name.endswith('.txt'):
+        # Blocks end on a line break so no word is split between two chunks. A line longer than
+        # READ_SIZE ends its block at a space instead, or anywhere once it has none, so what is
+        # held back stays under READ_SIZE however the file is laid out
+        decoder = codecs.getincrementaldecoder('utf-8')()
+        pending = ''
+        while True:
+            block = file.read(READ_SIZE)
+            if not block:
+                break
+            text = pending + decoder.decode(block)
+            cut = text.rfind('\n') + 1
+            if len(text) - cut >= READ_SIZE:
+                cut = text.rfind(' ') + 1 or len(text)
+            if cut:
+                yield text[:cut]
+            pending = text[cut:]
+        pending += decoder.decode(b'', final=True)
+        if pending:
+            yield pending
+    elif file_name.endswith('.docx'):
+        from docx import Document
+        doc = Document(file)
+        paragraphs = [para.text for para in doc.paragraphs]
+        for start in range(0, len(paragraphs), PARAGRAPHS_PER_CHUNK):
+            yield ' '.join(paragraphs[start:start + PARAGRAPHS_PER_CHUNK])
+    elif file_name.endswith('.pdf'):
+        from PyPDF2 import PdfReader
+        pdf = PdfReader(file)
+        for page_number, page in enumerate(pdf.pages):
+            if page_number >= max_pages:
+                break
+            yield page.extract_text()
+    elif file_name.endswith('.csv'):
+        import pandas as pd
+        rows = 0
+        for frame in pd.read_csv(file, encoding='utf-8', chunksize=ROWS_PER_CHUNK, nrows=max_rows):
+            rows += len(frame)
+            yield frame.to_string()
+            if rows >= max_rows:
+                break
+
+
+# Extracts a file on disk into a list of text chunks; used by the parser processes
+def extract_file(path, file_name, max_pages=MAX_PAGES, max_rows=MAX_ROWS, max_bytes=MAX_BYTES):
+    with open(path, 'rb') as f:
+        return list(iter_text_chunks(f, file_name, max_pages, max_rows, max_bytes))
+
+
+def extract_text(file_content, file_name):
+    return ' '.join(iter_text_chunks(io.BytesIO(file_content), file_name))
+
+
+# Loads the parsing libraries ahead of the first file; run in each parser process at startup
+def preload():
+    import docx
+    import PyPDF2
+    import pandas
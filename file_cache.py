@@ -0,0 +1,211 @@
+import collections
+import hashlib
+import io
+import json
+import os
+import tempfile
+import threading
+
+
+class FileCache:
+    # On-disk cache of downloaded SharePoint files and their extracted text.
+    # Blobs are content-addressed by SHA-256 and looked up by drive item id + eTag,
+    # so an unchanged file is served without any Graph call or re-parse.
+
+    def __init__(self, root, max_bytes=500 * 1024 * 1024):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.counters = collections.Counter()
+        os.makedirs(os.path.join(root, "blobs"), exist_ok=True)
+        # The index is a snapshot plus a journal of the changes made since, one JSON line each,
+        # so a put appends a line instead of rewriting the whole index. The snapshot is only
+        # rewritten once the journal holds about as many lines as the index has items
+        self.index_path = os.path.join(root, "index.json")
+        self.journal_path = os.path.join(root, "journal.jsonl")
+        self.items = {}
+        self.blobs = collections.OrderedDict()
+        if os.path.exists(self.index_path):
+            try:
+                with open(self.index_path, encoding="utf-8") as f:
+                    saved = json.load(f)
+                self.items = saved.get("items", {})
+                self.blobs = collections.OrderedDict(saved.get("blobs", []))
+            except (OSError, ValueError):
+                self.items = {}
+                self.blobs = collections.OrderedDict()
+        self.replay()
+        self.journal = open(self.journal_path, "a", encoding="utf-8")
+        self.journal_lines = 0
+        self.total = sum(self.blobs.values())
+        # Folding the journal in now also drops a line a crash may have cut short
+        self.save()
+
+    # Applies the journal to the snapshot; a line cut short by a crash ends it
+    def replay(self):
+        try:
+            with open(self.journal_path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        change = json.loads(line)
+                    except ValueError:
+                        break
+                    self.apply(change)
+        except OSError:
+            pass
+
+    def apply(self, change):
+        if "evict" in change:
+            digest = change["evict"]
+            self.blobs.pop(digest, None)
+            self.items = {item_id: entry for item_id, entry in self.items.items() if entry["digest"] != digest}
+        else:
+            digest, size = change["blob"]
+            self.blobs[digest] = size
+            self.blobs.move_to_end(digest)
+            self.items[change["item"]] = change["entry"]
+
+    def blob_path(self, digest, suffix=""):
+        return os.path.join(self.root, "blobs", digest + suffix)
+
+    def lookup(self, item_id, etag):
+        entry = self.items.get(item_id)
+        if entry is None or not etag or entry["etag"] != etag or entry["digest"] not in self.blobs:
+            return None
+        self.blobs.move_to_end(entry["digest"])
+        return entry
+
+    def get(self, item_id, etag):
+        with self.lock:
+            entry = self.lookup(item_id, etag)
+            if entry is None or entry.get("parse_seconds") is None:
+                self.counters["misses"] += 1
+                return None
+            try:
+                with open(self.blob_path(entry["digest"], ".txt"), encoding="utf-8") as f:
+                    text = f.read()
+            except OSError:
+                self.counters["misses"] += 1
+                return None
+            self.counters["hits"] += 1
+            self.counters["bytes_saved"] += entry["size"]
+            self.counters["parse_seconds_saved"] += entry["parse_seconds"]
+            return entry["name"], text
+
+    def get_content(self, item_id, etag):
+        with self.lock:
+            entry = self.lookup(item_id, etag)
+            if entry is not None:
+                try:
+                    with open(self.blob_path(entry["digest"]), "rb") as f:
+                        content = f.read()
+                except OSError:
+                    content = None
+                if content is not None:
+                    self.counters["content_hits"] += 1
+                    self.counters["bytes_saved"] += entry["size"]
+                    return entry["name"], content
+            self.counters["content_misses"] += 1
+            return None
+
+    # Like get_content(), but copies the content into a binary file object in blocks.
+    # Returns the file name, or None on a miss
+    def copy_content(self, item_id, etag, file):
+        with self.lock:
+            entry = self.lookup(item_id, etag)
+            try:
+                blob = open(self.blob_path(entry["digest"]), "rb") if entry is not None else None
+            except OSError:
+                blob = None
+            if blob is None:
+                self.counters["content_misses"] += 1
+                return None
+            self.counters["content_hits"] += 1
+            self.counters["bytes_saved"] += entry["size"]
+        # An evicted blob stays readable through the open handle
+        with blob:
+            for block in iter(lambda: blob.read(1024 * 1024), b""):
+                file.write(block)
+        return entry["name"]
+
+    def put(self, item_id, etag, name, content, text=None, parse_seconds=None):
+        self.put_file(item_id, etag, name, io.BytesIO(content), text, parse_seconds)
+
+    # Like put(), but copies the content from a binary file object in blocks
+    def put_file(self, item_id, etag, name, file, text=None, parse_seconds=None):
+        if not etag:
+            return
+        file.seek(0)
+        sha256 = hashlib.sha256()
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.join(self.root, "blobs"))
+        with os.fdopen(fd, "wb") as f:
+            for block in iter(lambda: file.read(1024 * 1024), b""):
+                sha256.update(block)
+                f.write(block)
+            content_size = f.tell()
+        digest = sha256.hexdigest()
+        with self.lock:
+            if digest in self.blobs:
+                os.remove(tmp_path)
+            else:
+                os.replace(tmp_path, self.blob_path(digest))
+            if text is not None:
+                self.write_file(self.blob_path(digest, ".txt"), text.encode("utf-8"))
+            size = content_size + (len(text.encode("utf-8")) if text is not None else 0)
+            size = max(size, self.blobs.get(digest, 0))
+            self.total += size - self.blobs.get(digest, 0)
+            previous = self.items.get(item_id, {})
+            if previous.get("digest") != digest:
+                previous = {}
+            change = {"item": item_id, "blob": [digest, size], "entry": {
+                "etag": etag,
+                "digest": digest,
+                "name": name,
+                "size": content_size,
+                "parse_seconds": parse_seconds if text is not None else previous.get("parse_seconds"),
+            }}
+            self.apply(change)
+            self.record(change)
+            self.evict()
+
+    def evict(self):
+        while self.total > self.max_bytes and len(self.blobs) > 1:
+            digest = next(iter(self.blobs))
+            self.total -= self.blobs[digest]
+            for suffix in ("", ".txt"):
+                try:
+                    os.remove(self.blob_path(digest, suffix))
+                except OSError:
+                    pass
+            change = {"evict": digest}
+            self.apply(change)
+            self.record(change)
+            self.counters["evictions"] += 1
+
+    def write_file(self, path, data):
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def record(self, change):
+        self.journal.write(json.dumps(change) + "\n")
+        self.journal.flush()
+        self.journal_lines += 1
+        if self.journal_lines > max(len(self.items), 1000):
+            self.save()
+
+    def save(self):
+        data = json.dumps({"items": self.items, "blobs": list(self.blobs.items())})
+        self.write_file(self.index_path, data.encode("utf-8"))
+        self.journal.truncate(0)
+        self.journal_lines = 0
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters)
+            stats["files"] = len(self.items)
+            stats["bytes"] = sum(self.blobs.values())
+        for key in ("hits", "misses", "content_hits", "content_misses", "bytes_saved", "parse_seconds_saved", "evictions"):
+            stats.setdefault(key, 0)
+        return stats
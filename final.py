@@ -1,18 +1,32 @@
 import streamlit as st
 import msal
-import requests
-import base64
+import html
 import time
 import re
-import io
-from docx import Document
-from PyPDF2 import PdfReader
-import pandas as pd
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
+import concurrent.futures
+import functools
+import tempfile
+import contextlib
+import hashlib
+import uuid
 from datetime import datetime, timedelta
-import streamlit_pagination as stp
-import zipfile
+from retrievers import make_retriever, answer_threshold
+from file_cache import FileCache
+from document_store import DocumentStore, SessionDocuments
+from search_cache import SearchCache
+from extract import MAX_PAGES, MAX_ROWS, MAX_BYTES, preload
+from pipeline import ParserPool
+from graph_client import GraphClient, GRAPH_URL
+from drive_mirror import DriveMirror
+from folder_tree import FolderTree
+from token_store import TokenStore
+from question_jobs import QuestionJobs
+from metrics import METRICS, REQUEST, span, bind_request, SamplingProfiler
+from folder_zip import walk_files, zip_files, remove_old_archives
+from sharepoint import (
+    ITEMS_PER_PAGE, get_site, list_accessible_sites, list_items, get_file_info, download_file, search_files,
+    federated_search, gather_documents, accessible_items, search_answer)
+import os
 
 # Azure AD app details
 client_id = st.secrets["CLIENT_ID"]
@@ -24,19 +38,38 @@ redirect_uri = st.secrets["URL"]
 # Define the scopes required for accessing SharePoint
 scopes = ["Files.ReadWrite.All", "Sites.Read.All", "User.Read"]
 
-# MSAL configuration
-app = msal.ConfidentialClientApplication(
-    client_id,
-    authority=authority_url,
-    client_credential=client_secret
-)
+# MSAL configuration, built once per process: creating the client looks the tenant's
+# endpoints up over the network, which used to happen on every rerun
+@st.cache_resource
+def get_msal_app():
+    return msal.ConfidentialClientApplication(
+        client_id,
+        authority=authority_url,
+        client_credential=client_secret
+    )
+
+# Every run of this script is one request for the stage timings
+REQUEST.set(uuid.uuid4().hex[:12])
+run_start = time.perf_counter()
+
+# Stage timings are shared by all sessions; set METRICS_PORT to serve them to Prometheus
+# on /metrics and METRICS_JSONL to append every span to a JSON lines file
+@st.cache_resource
+def start_metrics():
+    if st.secrets.get("METRICS_JSONL"):
+        METRICS.write_jsonl(st.secrets["METRICS_JSONL"])
+    if st.secrets.get("METRICS_PORT"):
+        METRICS.serve(int(st.secrets["METRICS_PORT"]))
+    return METRICS
+
+start_metrics()
 
 # Streamlit UI
 st.title("📂 SharePoint File Downloader and Query Chatbot")
 
 # Authentication flow
 def get_auth_url():
-    auth_url = app.get_authorization_request_url(
+    auth_url = get_msal_app().get_authorization_request_url(
         scopes, 
         redirect_uri=redirect_uri,
         state=st.session_state.get("state", "")
@@ -44,172 +77,474 @@ def get_auth_url():
     st.write(f"Debug: Auth URL is {auth_url}")  # Debug logging
     return auth_url
 
-def get_token_from_code(auth_code):
-    result = app.acquire_token_by_authorization_code(
-        auth_code, 
-        scopes=scopes, 
-        redirect_uri=redirect_uri
-    )
-    if "error" in result:
-        st.error(f"Error in token acquisition: {result.get('error_description', 'Unknown error')}")
-    return result
+# Seconds after a user's last request that they count as gone: their tokens are no longer
+# refreshed in the background and their site mirrors stop crawling
+TOKEN_IDLE_SECONDS = int(st.secrets.get("TOKEN_IDLE_SECONDS", 1800))
 
-# Cache the authentication headers
+# Per-user MSAL token caches shared by all sessions, held in memory only and refreshed before
+# expiry while the user has a session that was active within TOKEN_IDLE_SECONDS. A user inactive
+# for TOKEN_FORGET_SECONDS is dropped and signs in again. TOKEN_CACHE_DIR is only cleared of the
+# tokens earlier versions kept there
 @st.cache_resource
-def get_auth_headers(auth_code=None):
-    if auth_code:
-        token_response = get_token_from_code(auth_code)
-        if 'access_token' in token_response:
-            return {'Authorization': f'Bearer {token_response["access_token"]}'}
-    return None
+def get_token_store():
+    return TokenStore(
+        client_id, authority_url, client_secret, scopes, redirect_uri,
+        st.secrets.get("TOKEN_CACHE_DIR", ".token_cache"),
+        refresh_margin=int(st.secrets.get("TOKEN_REFRESH_MARGIN_SECONDS", 600)),
+        idle_timeout=TOKEN_IDLE_SECONDS,
+        forget_after=int(st.secrets.get("TOKEN_FORGET_SECONDS", 8 * 3600)))
+
+# Downloaded files and their extracted text, shared across sessions and users
+@st.cache_resource
+def get_file_cache():
+    return FileCache(
+        st.secrets.get("FILE_CACHE_DIR", ".file_cache"),
+        int(st.secrets.get("FILE_CACHE_MAX_BYTES", 500 * 1024 * 1024)))
+
+# Compressed extracted text shared by all sessions, stored once per item. A session's search
+# index holds about 20 times the text it indexes, so indexes are budgeted by what they hold:
+# SESSION_INDEX_MAX_BYTES for one session and INDEX_MAX_BYTES for all of them, past which the
+# indexing session drops its least recently used files
+@st.cache_resource
+def get_document_store():
+    return DocumentStore(int(st.secrets.get("DOCUMENT_STORE_MAX_BYTES", 200 * 1024 * 1024)),
+                         int(st.secrets.get("INDEX_MAX_BYTES", 2 * 1024 * 1024 * 1024)))
+
+SESSION_INDEX_MAX_BYTES = int(st.secrets.get("SESSION_INDEX_MAX_BYTES", 256 * 1024 * 1024))
+
+# Download threads and parser processes shared by all sessions. Parsers run their own entry
+# script, so they neither re-execute this one (as spawned workers would) nor inherit the server's
+# threads and held locks (as forked ones would), and a crashed parser is restarted. The parser
+# processes are started right away and import the parsing libraries in the background, so
+# neither the app's startup nor the first question waits for them
+@st.cache_resource
+def get_worker_pools():
+    download_pool = concurrent.futures.ThreadPoolExecutor(
+        max_workers=int(st.secrets.get("MAX_DOWNLOADS", 8)))
+    parse_pool = ParserPool(int(st.secrets.get("MAX_PARSERS", 2)), initializer=preload)
+    return download_pool, parse_pool
+
+# Seconds a question may spend looking files up, downloading and parsing them before it is
+# answered from what is ready, and how many of its best search hits are read at most
+QUESTION_DEADLINE_SECONDS = float(st.secrets.get("QUESTION_DEADLINE_SECONDS", 20))
+QUESTION_MAX_FILES = int(st.secrets.get("QUESTION_MAX_FILES", 100))
+ 
+# Caps on how much text is extracted from a single file
+EXTRACT_LIMITS = {
+    "max_pages": int(st.secrets.get("MAX_PDF_PAGES", MAX_PAGES)),
+    "max_rows": int(st.secrets.get("MAX_CSV_ROWS", MAX_ROWS)),
+    "max_bytes": int(st.secrets.get("MAX_TEXT_BYTES", MAX_BYTES)),
+}
+
+# How files reach the browser: "link" hands out Graph's short-lived pre-authenticated downloadUrl,
+# so the bytes never pass through this server; "spooled" fetches the file (or takes it from the
+# file cache) only when the button is clicked. Streamlit serves download data from memory, so
+# a spooled file is held whole in memory while the browser fetches it; files larger than
+# DOWNLOAD_MAX_BYTES are offered as a link instead
+DOWNLOAD_MODE = st.secrets.get("DOWNLOAD_MODE", "link")
+DOWNLOAD_MAX_BYTES = int(st.secrets.get("DOWNLOAD_MAX_BYTES", 20 * 1024 * 1024))
+
+# Caps on a single folder download. The archive is built on disk, but Streamlit keeps whatever
+# a download button serves in memory while the browser fetches it, so ZIP_MAX_BYTES also bounds
+# that memory per clicked archive. ZIP_DOWNLOADS is how many of a folder's files are downloaded
+# at once on the shared download threads
+ZIP_MAX_BYTES = int(st.secrets.get("ZIP_MAX_BYTES", 100 * 1024 * 1024))
+ZIP_MAX_FILES = int(st.secrets.get("ZIP_MAX_FILES", 1000))
+ZIP_DOWNLOADS = int(st.secrets.get("ZIP_DOWNLOADS", 4))
+
+# Archives are kept in ZIP_DIR for ZIP_KEEP_SECONDS, long enough to be downloaded, and removed
+# after that even when their session is gone. The directory is cleared of stale archives at
+# startup and whenever another archive is made
+ZIP_KEEP_SECONDS = int(st.secrets.get("ZIP_KEEP_SECONDS", 3600))
+
+@st.cache_resource
+def get_archive_dir():
+    directory = st.secrets.get("ZIP_DIR", os.path.join(tempfile.gettempdir(), "folder-archives"))
+    os.makedirs(directory, exist_ok=True)
+    remove_old_archives(directory, ZIP_KEEP_SECONDS)
+    return directory
+
+# One pooled Graph client per session, with configurable timeouts and retries
+def get_graph_client(headers):
+    if 'graph' not in st.session_state:
+        st.session_state.graph = GraphClient(
+            timeout=(float(st.secrets.get("GRAPH_CONNECT_TIMEOUT", 5)), float(st.secrets.get("GRAPH_READ_TIMEOUT", 60))),
+            max_retries=int(st.secrets.get("GRAPH_MAX_RETRIES", 4)),
+            base_url=st.secrets.get("GRAPH_URL", GRAPH_URL))
+    st.session_state.graph.headers = headers
+    return st.session_state.graph
+
+# Local delta-synced mirrors of sites, by (user, site id), shared by that user's sessions. Each
+# is crawled with its own user's token, so it only holds what that user can read. The crawl
+# doesn't count as the user being active, and pauses once none of their sessions has used the
+# mirror for TOKEN_IDLE_SECONDS; the next use resumes it
+@st.cache_resource
+def get_drive_mirrors():
+    return {}
+ 
+def start_drive_mirror(site_info):
+    key = (st.session_state.user_key, site_info['id'])
+    mirrors = get_drive_mirrors()
+    if key not in mirrors:
+        headers = functools.partial(get_token_store().headers, key[0], active=False)
+        graph = GraphClient(headers, base_url=st.secrets.get("GRAPH_URL", GRAPH_URL))
+        db_name = hashlib.sha256(f"{key[0]}/{key[1]}".encode()).hexdigest()
+        db_path = os.path.join(st.secrets.get("MIRROR_DIR", ".mirrors"), f"{db_name}.db")
+        mirrors[key] = DriveMirror(db_path, graph, site_info['id'], get_file_cache(), extract_limits=EXTRACT_LIMITS)
+    mirrors[key].start(interval=int(st.secrets.get("MIRROR_SYNC_SECONDS", 300)), idle_timeout=TOKEN_IDLE_SECONDS)
+    return mirrors[key]
+
+def stop_drive_mirror(site_info):
+    mirror = get_drive_mirrors().pop((st.session_state.user_key, site_info['id']), None)
+    if mirror:
+        mirror.stop()
+
+# Returns a function giving the signed-in user's current auth headers, or None when sign-in
+# failed. The code is only redeemed once; after that the token store refreshes silently
+def get_auth_headers(auth_code):
+    store = get_token_store()
+    if 'user_key' not in st.session_state:
+        user_key, error = store.redeem_code(auth_code)
+        if user_key is None:
+            st.error(f"Error in token acquisition: {error}")
+            return None
+        st.session_state.user_key = user_key
+        # The spent code shouldn't linger in the address bar, browser history or shared links
+        st.query_params.pop('code', None)
+    user_key = st.session_state.user_key
+    if store.headers(user_key) is None:
+        st.error(f"Error in token acquisition: {store.error(user_key)}")
+        # Drop the spent code so the next run offers to sign in again
+        del st.session_state['auth_code'], st.session_state['user_key']
+        st.query_params.pop('code', None)
+        return None
+    return functools.partial(store.headers, user_key)
  
 # Add this to initialize folder path in session state
 if 'current_folder_path' not in st.session_state:
     st.session_state.current_folder_path = ""
  
-# Update the list_items function to handle folder navigation and check for empty folders/sites
-def list_items(url, headers, path="", prefix="", indent=""):
-    items_list = []
-    file_count = 0
-    folder_count = 0
-    response = requests.get(url, headers=headers)
-    if response.status_code == 200:
-        items = response.json().get('value', [])
-        if not items:
-            # Return a special item to indicate empty folder/site
-            return [("empty", "", "This folder/site is empty", "Empty", "")], 0, 0
-        for idx, item in enumerate(items, start=1):
-            item_type = 'File' if 'file' in item else 'Folder'
-            if item_type == 'File':
-                file_count += 1
-            else:
-                folder_count += 1
-            full_path = f"{path}/{item['name']}".lstrip("/")
-            item_prefix = f"{prefix}{idx}"
-            items_list.append(
-                (item_prefix, full_path, f"{indent}{item_prefix}. {item['name']} ({item_type})", item_type, item['id']))
-            if item_type == 'Folder' and st.session_state.current_folder_path == full_path:
-                child_url = f"https://graph.microsoft.com/v1.0/sites/{site_info['id']}/drive/items/{item['id']}/children"
-                sub_items_list, sub_file_count, sub_folder_count = list_items(
-                    child_url, headers, full_path, f"{item_prefix}.", indent + "  ")
-                items_list.extend(sub_items_list)
-                file_count += sub_file_count
-                folder_count += sub_folder_count
-    return items_list, file_count, folder_count
- 
-def download_file(site_id, file_path, headers):
-    file_url = f"https://graph.microsoft.com/v1.0/sites/{site_id}/drive/root:/{file_path}:/content"
-    download_response = requests.get(file_url, headers=headers)
- 
-    if download_response.status_code == 200:
-        return download_response.content, file_path.split("/")[-1]
-    return None, None
- 
-def search_files(site_id, query, headers):
-    search_url = f"https://graph.microsoft.com/v1.0/sites/{site_info['id']}/drive/root/search(q='{query}')"
-    response = requests.get(search_url, headers=headers)
-    if response.status_code == 200:
-        items = response.json().get('value', [])
-        return items
-    return []
- 
-def read_file_content(file_content, file_name):
-    content = ""
-    try:
-        if file_name.endswith('.txt'):
-            content = file_content.decode('utf-8')
-        elif file_name.endswith('.docx'):
-            doc = Document(io.BytesIO(file_content))
-            content = ' '.join([para.text for para in doc.paragraphs])
-        elif file_name.endswith('.pdf'):
-            pdf = PdfReader(io.BytesIO(file_content))
-            content = ' '.join([page.extract_text() for page in pdf.pages])
-        elif file_name.endswith('.csv'):
-            df = pd.read_csv(io.StringIO(file_content.decode('utf-8')))
-            content = df.to_string()
-    except Exception as e:
-        st.error(f"Error reading {file_name}: {str(e)}")
-    return content
- 
-def preprocess_content(content):
-    lines = content.split('\n')
-    processed_lines = [line for line in lines if len(
-        line.split()) > 3 and not line.strip().startswith('http')]
-    return ' '.join(processed_lines)
- 
-def search_answer(question, file_contents):
-    if not file_contents:
-        return "I couldn't find any content in the files to answer the question."
- 
-    # Combine all file contents, keeping track of which document each sentence comes from
-    all_content = []
-    for doc_name, content in file_contents.items():
-        sentences = [sent.strip()
-                     for sent in content.split('.') if sent.strip()]
-        all_content.extend([(sent, doc_name) for sent in sentences])
- 
-    # Separate sentences and document names
-    sentences, doc_names = zip(*all_content)
-    sentences = list(sentences)
- 
-    # Add the question to the sentences
-    sentences.append(question)
- 
-    # Create TF-IDF vectors
-    vectorizer = TfidfVectorizer()
-    tfidf_matrix = vectorizer.fit_transform(sentences)
- 
-    # Compute cosine similarity
-    cosine_similarities = cosine_similarity(
-        tfidf_matrix[-1:], tfidf_matrix[:-1])[0]
- 
-    # Get indices of sentences with a similarity above the threshold
-    relevant_sentence_indices = [i for i, score in enumerate(
-        cosine_similarities) if score > 0.2]
- 
-    answers_dict = {}
- 
-    for idx in relevant_sentence_indices:
-        sentence = sentences[idx].strip()
-        # Remove citations and irrelevant information
-        sentence = re.sub(r'\[[^\]]*\]', '', sentence)
-        sentence = re.sub(r'\s+', ' ', sentence).strip()
- 
-        # Check if the sentence is complete and relevant
-        if len(sentence.split()) > 5 and not sentence.startswith("Artificial intelligence") and "founding fathers of AI" not in sentence:
-            doc_name = doc_names[idx]
-            if doc_name not in answers_dict:
-                answers_dict[doc_name] = []
-            answers_dict[doc_name].append(sentence)
- 
-    if answers_dict:
-        answer = "Here's what I found about your question:\n\n"
-        for doc_name, relevant_sentences in answers_dict.items():
-            combined_answer = ' '.join(relevant_sentences)
-            combined_answer = combined_answer.capitalize()
-            if not combined_answer.endswith('.'):
-                combined_answer += '.'
-            answer += f"**Source: {doc_name}**\n{combined_answer}\n\n"
+# Cached, lazily paged folder listings for each site this session has browsed
+def get_folder_tree(graph, site_id):
+    if 'folder_trees' not in st.session_state:
+        st.session_state.folder_trees = {}
+    if site_id not in st.session_state.folder_trees:
+        st.session_state.folder_trees[site_id] = FolderTree(
+            graph, site_id, page_size=ITEMS_PER_PAGE, ttl=int(st.secrets.get("FOLDER_CACHE_TTL", 300)))
+    return st.session_state.folder_trees[site_id]
+ 
+# Looks a site up by name, reusing this session's answer for FOLDER_CACHE_TTL seconds
+def resolve_site(graph, site_name):
+    if 'sites' not in st.session_state:
+        st.session_state.sites = {}
+    cached = st.session_state.sites.get(site_name)
+    if cached and time.monotonic() - cached[1] < int(st.secrets.get("FOLDER_CACHE_TTL", 300)):
+        return cached[0]
+    site = get_site(graph, site_name)
+    if site is None:
+        return None
+    st.session_state.sites[site_name] = (site, time.monotonic())
+    return st.session_state.sites[site_name][0]
+
+# The sites the user can access, looked up once per session
+def get_accessible_sites(graph):
+    if not st.session_state.get('accessible_sites'):
+        st.session_state.accessible_sites = list_accessible_sites(graph)
+    return st.session_state.accessible_sites
+
+# Forgets this session's site lookups and folder listings, so the next run reads them again
+def refresh_listings():
+    st.session_state.pop('sites', None)
+    st.session_state.pop('accessible_sites', None)
+    for tree in st.session_state.get('folder_trees', {}).values():
+        tree.invalidate()
+ 
+def read_download(file_info, graph, file_cache):
+    f = download_file(file_info, graph, file_cache, DOWNLOAD_MAX_BYTES, DOWNLOAD_MAX_BYTES)
+    if f is None:
+        return b""
+    with f:
+        return f.read()
+
+# Offers a file for download without embedding its bytes in the page
+def offer_download(file_info, graph):
+    file_name = file_info['name']
+    if DOWNLOAD_MODE == "spooled" and file_info.get('size', 0) <= DOWNLOAD_MAX_BYTES:
+        # The file is fetched when the button is clicked and is not re-sent on reruns
+        st.download_button(
+            f"Click here to download {file_name}",
+            data=functools.partial(read_download, file_info, graph, get_file_cache()),
+            file_name=file_name, on_click="ignore", key=f"download-{file_info['id']}")
     else:
-        answer = "I'm sorry, but I couldn't find any relevant information to answer your question."
+        download_url = html.escape(file_info['@microsoft.graph.downloadUrl'])
+        st.markdown(f'<a href="{download_url}" download="{html.escape(file_name)}">Click here to download {html.escape(file_name)}</a>',
+                    unsafe_allow_html=True)
  
-    return answer
+# Read only when the button is clicked; Streamlit serves download data from memory. An archive
+# removed for its age downloads as an empty file
+def read_archive(path):
+    try:
+        with open(path, 'rb') as f:
+            return f.read()
+    except OSError:
+        return b""
 
-def list_accessible_sites(headers):
-    sites_url = "https://graph.microsoft.com/v1.0/sites?search=*"
-    response = requests.get(sites_url, headers=headers)
-    if response.status_code == 200:
-        sites = response.json().get('value', [])
-        return [(site['name'], site['webUrl']) for site in sites]
-    return []
- 
-# Function to add a message to the chat history
-def add_message(role, content):
-    timestamp = datetime.now()
-    st.session_state.messages.append({"role": role, "content": content, "timestamp": timestamp})
+# Zips a folder's whole subtree into a temporary file, showing progress, and offers it for download
+def download_folder(site_id, folder_path, graph):
+    folder_name = folder_path.split("/")[-1]
+    folder = get_folder_tree(graph, site_id).folder(folder_path)
+    if folder is None:
+        add_message("assistant", f"I'm sorry, I couldn't access the folder '{folder_name}'. Please try again.")
+        return
+    add_message("assistant", f"Preparing '{folder_name}' as a ZIP archive...")
+    progress_bar = st.progress(0.0, text="Listing files...")
+ 
+    def show_progress(done, total, bytes_done, seconds):
+        progress_bar.progress(done / total, text=(
+            f"{done} of {total} files, {bytes_done / 1e6:.1f} MB at {bytes_done / 1e6 / max(seconds, 0.001):.1f} MB/s"))
+ 
+    # Each session keeps only its latest archive on disk
+    if st.session_state.get('folder_archive'):
+        try:
+            os.remove(st.session_state.folder_archive)
+        except OSError:
+            pass
+        st.session_state.folder_archive = None
+    archive_dir = get_archive_dir()
+    remove_old_archives(archive_dir, ZIP_KEEP_SECONDS)
+    with tempfile.NamedTemporaryFile(prefix="folder-", suffix=".zip", dir=archive_dir, delete=False) as f:
+        archive_path = f.name
+    try:
+        files = walk_files(graph, site_id, folder["id"], ZIP_MAX_FILES)
+        if not files:
+            raise ValueError("it has no files")
+        download_pool, _ = get_worker_pools()
+        written, bytes_done, failed = zip_files(
+            graph, site_id, files, archive_path, download_pool, ZIP_MAX_BYTES, show_progress, ZIP_DOWNLOADS)
+    except (ValueError, RuntimeError) as e:
+        os.remove(archive_path)
+        progress_bar.empty()
+        add_message("assistant", f"I'm sorry, I couldn't download '{folder_name}': {e}.")
+        return
+    st.session_state.folder_archive = archive_path
+    add_message("assistant", f"Great! I've packed {written} files ({bytes_done / 1e6:.1f} MB) from '{folder_name}'"
+                + (f". {len(failed)} files couldn't be downloaded: {', '.join(failed[:10])}" if failed else "") + ".")
+    st.download_button(
+        f"Click here to download {folder_name}.zip", data=functools.partial(read_archive, archive_path),
+        file_name=f"{folder_name}.zip", mime="application/zip", on_click="ignore", key=f"archive-{folder['id']}")
+ 
+def index_file(file_name, chunks, item):
+    with span("index", items=1) as timing:
+        text = ' '.join(chunks)
+        st.session_state.search_index.add_chunks(file_name, chunks)
+        # May drop this session's least recently used files from the index
+        st.session_state.documents.add(
+            item['id'], item.get('eTag'), file_name, text, st.session_state.search_index.document_bytes(file_name))
+        timing["bytes"] = len(text)
+ 
+# Questions are answered on background threads shared by all sessions, so the page stays
+# responsive and shows the answer as it builds up. An identical question asked while one is in
+# progress joins it: anyone's on the same site by default, or only the same user's with
+# QUESTION_SHARING = "user". A session only indexes the documents of another user's question,
+# and names the files it couldn't read, that its own user can read
+@st.cache_resource
+def get_question_jobs():
+    return QuestionJobs(concurrent.futures.ThreadPoolExecutor(max_workers=int(st.secrets.get("QUESTION_WORKERS", 4))))
+
+QUESTION_SHARING = st.secrets.get("QUESTION_SHARING", "site")
+QUESTION_POLL_SECONDS = float(st.secrets.get("QUESTION_POLL_SECONDS", 0.5))
+
+# Search results kept for SEARCH_CACHE_TTL seconds, and the threads that search several sites
+# at once, shared by every session. A federated search runs at most SEARCH_CONCURRENCY of its
+# sites at a time, so one user's search can't take every thread, and a site that hasn't answered
+# within SEARCH_TIMEOUT_SECONDS of its search starting is left out
+@st.cache_resource
+def get_search_cache():
+    return SearchCache(int(st.secrets.get("SEARCH_CACHE_TTL", 300)))
+
+@st.cache_resource
+def get_search_pool():
+    return concurrent.futures.ThreadPoolExecutor(max_workers=int(st.secrets.get("SEARCH_WORKERS", 8)))
+
+SEARCH_TIMEOUT_SECONDS = float(st.secrets.get("SEARCH_TIMEOUT_SECONDS", 10))
+SEARCH_CONCURRENCY = int(st.secrets.get("SEARCH_CONCURRENCY", 4))
+
+# Sites named when some were left out of a federated search; the rest are only counted
+FAILED_SITES_SHOWN = 5
+
+def failed_sites_message(failed_sites):
+    names = ", ".join(failed_sites[:FAILED_SITES_SHOWN])
+    if len(failed_sites) > FAILED_SITES_SHOWN:
+        names += f" and {len(failed_sites) - FAILED_SITES_SHOWN} more sites"
+    return f"I couldn't search {names} in time, so they're left out."
+
+# Most hits a search returns, per site and after merging; further result pages aren't fetched
+SEARCH_MAX_RESULTS = int(st.secrets.get("SEARCH_MAX_RESULTS", 200))
+
+# Cached search results are shared like questions: everyone's are reused by default, after
+# checking the hits against the user's own access, as Graph trims search results to what each
+# user may see. With QUESTION_SHARING = "user" each user only reuses their own
+SHARED_SEARCH = QUESTION_SHARING == "site"
+
+def search_scope():
+    return None if SHARED_SEARCH else st.session_state.user_key
+
+# The sites a federated search covers, as [(site id, site name)]: the ones picked in the
+# sidebar, or every accessible site
+def federated_sites(graph):
+    sites = get_accessible_sites(graph)
+    chosen = st.session_state.get('federated_sites')
+    return [(site[2], site[0]) for site in sites if not chosen or site[0] in chosen]
+
+def session_id():
+    if 'session_id' not in st.session_state:
+        st.session_state.session_id = uuid.uuid4().hex
+    return st.session_state.session_id
+
+# Searches for files and reads them in the background; the session indexes each one as it arrives.
+# With `sites`, the question is searched across all of them instead of a single site
+def start_question(question, site_id, graph, mirror, sites=None):
+    file_cache, store = get_file_cache(), get_document_store()
+    download_pool, parse_pool = get_worker_pools()
+    search_cache, search_pool, scope = get_search_cache(), get_search_pool(), search_scope()
+    profile = st.session_state.get('profile_questions')
+
+    def work(job):
+        profiler = SamplingProfiler() if profile else None
+        with profiler or contextlib.nullcontext(), span("question"):
+            # The question's deadline covers its search as well
+            deadline = time.monotonic() + QUESTION_DEADLINE_SECONDS
+            search_results = None
+            if sites:
+                search_results, job.failed_sites = federated_search(
+                    sites, question, graph, search_pool, SEARCH_TIMEOUT_SECONDS, search_cache, scope,
+                    SHARED_SEARCH, SEARCH_MAX_RESULTS, SEARCH_CONCURRENCY, deadline)
+            elif not mirror:
+                search_results = search_files(
+                    site_id, question, graph, search_cache, scope, SHARED_SEARCH, SEARCH_MAX_RESULTS, deadline)
+            job.search_results, job.completed, job.errors = gather_documents(
+                site_id, question, graph, file_cache, store, job.add_document, download_pool, parse_pool,
+                max(deadline - time.monotonic(), 0), EXTRACT_LIMITS, mirror, job.cancelled, search_results,
+                QUESTION_MAX_FILES)
+        job.profiler = profiler
+
+    key = (tuple(site[0] for site in sites) if sites else site_id, " ".join(question.lower().split()))
+    if QUESTION_SHARING != "site":
+        key += (st.session_state.user_key,)
+    job = get_question_jobs().submit(key, bind_request(work), session_id(), st.session_state.user_key)
+    st.session_state.question = {"job": job, "question": question, "cursor": 0, "answer": None, "site_id": site_id,
+                                 "verify": job.owner != st.session_state.user_key}
+
+# Stops following this session's question; the job itself stops once nobody follows it
+def cancel_question():
+    state = st.session_state.pop('question', None)
+    if state:
+        state["job"].unsubscribe(session_id())
+    st.session_state.pop('last_answer', None)
+
+# Indexes the documents the question's job has brought in since the last poll, and shows the
+# answer so far with its sources ranked by score. Once the job is done the final answer is
+# kept in the chat history and the whole page reruns, which stops the polling
+@st.fragment(run_every=QUESTION_POLL_SECONDS)
+def show_question_progress():
+    state = st.session_state.get('question')
+    if state is None:
+        return
+    job = state["job"]
+    # Checked before reading documents, so none added after it is missed
+    finished = job.done()
+    new_documents = job.documents_since(state["cursor"])
+    state["cursor"] += len(new_documents)
+    if state["verify"] and new_documents:
+        # Another user's question read these with their token
+        readable = {item['id'] for item in accessible_items(
+            state["site_id"], [document[0] for document in new_documents], st.session_state.graph)}
+        new_documents = [document for document in new_documents if document[0]['id'] in readable]
+    for item, file_name, chunks in new_documents:
+        if not st.session_state.documents.touch(item['id'], item.get('eTag')):
+            index_file(file_name, chunks, item)
+    if new_documents:
+        state["answer"] = search_answer(state["question"], st.session_state.search_index, threshold=ANSWER_THRESHOLD)
+
+    if not finished:
+        show_message("assistant", f"Read {state['cursor']} files so far..."
+                     + (f"\n\n{state['answer']}" if state["answer"] else ""))
+        return
+
+    errors = job.errors
+    if state["verify"] and errors:
+        readable = {item['id'] for item in accessible_items(
+            state["site_id"], [error[0] for error in errors], st.session_state.graph)}
+        errors = [error for error in errors if error[0]['id'] in readable]
+    messages = []
+    if job.failed_sites:
+        messages.append(failed_sites_message(job.failed_sites))
+    if job.error:
+        messages.append(f"I'm sorry, something went wrong while answering your question: {job.error}")
+    elif not job.search_results:
+        messages.append("I'm sorry, I couldn't find any relevant files to answer your question.")
+    else:
+        if not job.completed:
+            messages.append("Some files took too long to read, so I'm answering from the ones that were ready.")
+        messages.append(state["answer"] or search_answer(state["question"], st.session_state.search_index, threshold=ANSWER_THRESHOLD))
+    for content in messages:
+        remember_message("assistant", content)
+    st.session_state.last_answer = {"question": state["question"], "messages": messages, "errors": [(file_name, error) for _, file_name, error in errors],
+                                    "profiler": job.profiler}
+    del st.session_state['question']
+    st.rerun()
+
+# The answer to the last question, shown until the next prompt
+def show_last_answer():
+    last = st.session_state.last_answer
+    show_message("user", f"Question: {last['question']}")
+    for file_name, error in last["errors"]:
+        st.error(f"Error reading {file_name}: {str(error)}")
+    for content in last["messages"]:
+        show_message("assistant", content)
+    if last["profiler"]:
+        show_profile(last["profiler"])
+ 
+# Sentence retriever used to answer questions: "tfidf" or "embedding"
+RETRIEVER = st.secrets.get("RETRIEVER", "tfidf")
+ANSWER_THRESHOLD = float(st.secrets.get("ANSWER_THRESHOLD", answer_threshold(RETRIEVER)))
+
+def new_search_index():
+    if RETRIEVER == "embedding":
+        return make_retriever(RETRIEVER, dim=int(st.secrets.get("EMBEDDING_DIM", 1024)),
+                              directory=st.secrets.get("EMBEDDING_DIR"))
+    return make_retriever(RETRIEVER)
+ 
+# Shows where a profiled question spent its time, by share of the stack samples
+def show_profile(profiler):
+    with st.sidebar.expander(f"Question profile ({profiler.samples} samples)", expanded=True):
+        st.markdown(markdown_table([{"function": function, "share": f"{share:.0%}"} for function, share in profiler.top(15)]))
+        st.download_button("Collapsed stacks", profiler.collapsed(), file_name="question-profile.txt")
+
+# A small table as markdown, which renders without building a DataFrame on every rerun
+def markdown_table(rows):
+    if not rows:
+        return ""
+    columns = list(rows[0])
+    lines = ["| " + " | ".join(columns) + " |", "|" + " --- |" * len(columns)]
+    lines += ["| " + " | ".join(str(row[column]).replace("|", "\\|") for column in columns) + " |" for row in rows]
+    return "\n".join(lines)
+
+# Shows a message without adding it to the chat history, for messages rebuilt on every rerun
+def show_message(role, content):
     with st.chat_message(role):
         st.markdown(content)
 
+# Adds a message to the chat history without showing it
+def remember_message(role, content):
+    timestamp = datetime.now()
+    st.session_state.messages.append({"role": role, "content": content, "timestamp": timestamp})
+
+# Function to add a message to the chat history
+def add_message(role, content):
+    remember_message(role, content)
+    show_message(role, content)
+
 # Main conversation flow starts here...
 if 'auth_code' not in st.session_state:
     if 'code' in st.query_params:
@@ -220,14 +555,48 @@ if 'auth_code' not in st.session_state:
         st.query_params["auth_url"] = auth_url
         st.rerun()
 else:
-    headers = get_auth_headers(st.session_state['auth_code'])
+    with span("auth"):
+        headers = get_auth_headers(st.session_state['auth_code'])
     if headers:
+        graph = get_graph_client(headers)
+        get_worker_pools()
         st.success("Authentication successful!")
+        cache_stats = get_file_cache().stats()
+        st.sidebar.caption(
+            f"File cache: {cache_stats['hits'] + cache_stats['content_hits']} hits, "
+            f"{cache_stats['misses'] + cache_stats['content_misses']} misses, "
+            f"{cache_stats['bytes_saved'] / 1e6:.1f} MB and {cache_stats['parse_seconds_saved']:.1f}s parsing saved")
+        store_stats = get_document_store().stats()
+        st.sidebar.caption(
+            f"Document store: {store_stats['documents']} files in {store_stats['bytes'] / 1e6:.1f} MB, "
+            f"{store_stats['hits']} hits, {store_stats['evictions']} evictions. "
+            f"Search indexes: {store_stats['index_bytes'] / 1e6:.1f} MB")
+        with st.sidebar.expander("Graph requests"):
+            st.markdown(markdown_table([
+                {"endpoint": name, "requests": stats["requests"], "errors": stats["errors"], "throttled": stats["throttled"],
+                 "avg ms": round(stats["seconds"] / stats["requests"] * 1000), "max ms": round(stats["max_seconds"] * 1000)}
+                for name, stats in graph.endpoint_stats().items()]))
+        with st.sidebar.expander("Stage timings"):
+            st.markdown(markdown_table([
+                {"stage": stage, "count": stats["count"], "avg ms": round(stats["seconds"] / stats["count"] * 1000),
+                 "MB": round(stats["bytes"] / 1e6, 1), "items": stats["items"], "errors": stats["errors"]}
+                for stage, stats in sorted(METRICS.snapshot().items())]))
+        st.sidebar.toggle("Profile questions", key="profile_questions")
+        # Federated mode searches questions and queries across several sites at once
+        federated = st.sidebar.toggle("Search all my sites", key="federated")
+        if federated:
+            st.sidebar.multiselect(
+                "Only these sites (all when empty)", [site[0] for site in get_accessible_sites(graph)],
+                key="federated_sites")
+        if st.sidebar.button("Refresh sites and folders"):
+            refresh_listings()
         if 'messages' not in st.session_state:
             st.session_state.messages = []
             st.session_state.items_dict = {}
             st.session_state.search_results_dict = {}
-            st.session_state.file_contents = {}
+            st.session_state.search_index = new_search_index()
+            st.session_state.documents = SessionDocuments(
+                get_document_store(), SESSION_INDEX_MAX_BYTES, st.session_state.search_index.remove_document)
  
         # Display chat history
         # display_chat_history()
@@ -239,38 +608,39 @@ else:
         # Get user input for viewing sites
         user_input = st.text_input("Your response:")
         if user_input.lower() == 'yes':
-            accessible_sites = list_accessible_sites(headers)
+            accessible_sites = get_accessible_sites(graph)
             if accessible_sites:
                 sites_list = "\n".join([f"{idx + 1}. {site[0]} - {site[1]}" for idx, site in enumerate(accessible_sites)])
-                add_message("assistant", f"Here are the SharePoint sites you have access to:\n\n{sites_list}")
-                add_message("assistant", "Please enter the name of the SharePoint site you want to access (e.g., 'Chatbot_resource').")
+                show_message("assistant", f"Here are the SharePoint sites you have access to:\n\n{sites_list}")
+                show_message("assistant", "Please enter the name of the SharePoint site you want to access (e.g., 'Chatbot_resource').")
             else:
-                add_message("assistant", "I'm sorry, I couldn't retrieve the list of accessible sites. Please enter the name of the SharePoint site you want to access.")
+                show_message("assistant", "I'm sorry, I couldn't retrieve the list of accessible sites. Please enter the name of the SharePoint site you want to access.")
         elif user_input.lower() == 'no':
-            add_message("assistant", "Alright. Please enter the name of the SharePoint site you want to access (e.g., 'Chatbot_resource').")
+            show_message("assistant", "Alright. Please enter the name of the SharePoint site you want to access (e.g., 'Chatbot_resource').")
  
         # Get site name input from user
         site_name = st.text_input("SharePoint Site Name:")
  
-        # Define items per page
-        ITEMS_PER_PAGE = 20
- 
         # Function to get paginated items
-        def get_paginated_items(items_list, page, items_per_page=ITEMS_PER_PAGE):
+        def get_paginated_items(items_list, page, total_items, items_per_page=ITEMS_PER_PAGE):
             start_index = (page - 1) * items_per_page
             end_index = start_index + items_per_page
-            return items_list[start_index:end_index], len(items_list) // items_per_page + (1 if len(items_list) % items_per_page != 0 else 0)
+            return items_list[start_index:end_index], total_items // items_per_page + (1 if total_items % items_per_page != 0 else 0)
  
         # Track the current page in the session state
         if 'current_page' not in st.session_state:
             st.session_state.current_page = 1
  
         # Add a function to display items with pagination and folder navigation
-        def show_paginated_items(items_list, file_count, folder_count):
+        def show_paginated_items(items_list, total_items, complete):
             current_items, total_pages = get_paginated_items(
-                items_list, st.session_state.current_page)
+                items_list, st.session_state.current_page, total_items)
  
-            st.write(f"Total Files: {file_count}, Total Folders: {folder_count}")
+            if complete:
+                file_count = sum(1 for item in items_list if item[3] == 'File')
+                st.write(f"Total Files: {file_count}, Total Folders: {len(items_list) - file_count}")
+            else:
+                st.write(f"Total Items: {total_items}")
            
             html_string = "<br>".join(
                 f"<span style='font-size:15px'>{item[2]}</span>" for item in current_items)
@@ -303,59 +673,93 @@ else:
                     st.rerun()
            
         # Update the main conversation flow to handle folder navigation and empty folders/sites
+        mirror = None
         if site_name:
-            site_info_url = f'https://graph.microsoft.com/v1.0/sites/novintix.sharepoint.com:/sites/{site_name}'
-            site_response = requests.get(site_info_url, headers=headers)
- 
-            if site_response.status_code == 200:
-                site_info = site_response.json()
-                if st.session_state.current_folder_path:
-                    drive_url = f"https://graph.microsoft.com/v1.0/sites/{site_info['id']}/drive/root:/{st.session_state.current_folder_path}:/children"
-                else:
-                    drive_url = f"https://graph.microsoft.com/v1.0/sites/{site_info['id']}/drive/root/children"
- 
-                items_list, file_count, folder_count = list_items(
-                    drive_url, headers, st.session_state.current_folder_path)
- 
+            # Looked up with this session's own token, so a site the user can't access isn't shown
+            site_info = resolve_site(graph, site_name)
+ 
+            if site_info is not None:
+                # With a synced local mirror of their own, the user browses and searches the site
+                # without calling Graph
+                mirror = get_drive_mirrors().get((st.session_state.user_key, site_info['id']))
+                if st.sidebar.toggle("Keep a local mirror of this site", value=mirror is not None):
+                    mirror = start_drive_mirror(site_info)
+                    files, folders, texts = mirror.counts()
+                    st.sidebar.caption(
+                        f"Mirror: {files} files, {folders} folders, {texts} indexed"
+                        + ("" if mirror.is_ready() else " (initial sync in progress)")
+                        + (f". Last error: {mirror.last_error}" if mirror.last_error else ""))
+                elif mirror:
+                    stop_drive_mirror(site_info)
+                    mirror = None
+                if mirror and not mirror.is_ready():
+                    mirror = None
+                items_list, total_items, complete = list_items(
+                    get_folder_tree(graph, site_info['id']), st.session_state.current_folder_path,
+                    st.session_state.current_page * ITEMS_PER_PAGE, mirror, ITEMS_PER_PAGE)
+ 
+                # Rebuilt on every rerun, so shown without growing the chat history
                 if items_list and items_list[0][0] == "empty":
-                    add_message(
+                    show_message(
                         "assistant", f"The SharePoint site '{site_name}' or the current folder is empty.")
                 else:
                     st.session_state.items_dict = {
                         item[0]: (item[1], item[3]) for item in items_list}
-                    add_message(
+                    show_message(
                         "assistant", f"Here are the contents of the SharePoint site '{site_name}':")
-                    show_paginated_items(items_list, file_count, folder_count)  # Show items with pagination and counts
-                    add_message(
+                    show_paginated_items(items_list, total_items, complete)  # Show items with pagination and counts
+                    show_message(
                         "assistant", "Please provide the item number to view a folder's contents, to download('folder 1') or download a file. Or, ask a question by starting with 'Question:'")
             else:
-                add_message(
+                show_message(
                     "assistant", "I'm sorry, I couldn't access the SharePoint site. Please check the site name and try again.")
  
         # Main conversation flow handling folder download requests and questions
         if prompt := st.chat_input("You:"):
+            # A new prompt cancels the question still being answered
+            cancel_question()
             add_message("user", prompt)
+            # Numbers given right after a search pick from its results, until another prompt is given
+            search_results_dict = st.session_state.get('search_results_dict') or {}
+            if prompt.strip() not in search_results_dict:
+                st.session_state.search_results_dict = {}
+ 
+            if prompt.strip() in search_results_dict:
+                file_site_id, file_id = search_results_dict[prompt.strip()]
+                file_info = get_file_info(file_site_id, graph, file_id=file_id)
+ 
+                if file_info and '@microsoft.graph.downloadUrl' in file_info:
+                    add_message(
+                        "assistant", f"Great! '{file_info['name']}' is ready for you to download.")
+ 
+                    # Create a download button
+                    offer_download(file_info, graph)
+ 
+                    add_message(
+                        "assistant", "Is there anything else you'd like to do? (Yes/No)")
+                else:
+                    add_message(
+                        "assistant", "I'm sorry, I couldn't retrieve the file information. Please try again.")
  
-            if prompt.lower().startswith("question:"):
+            elif prompt.lower().startswith("question:"):
                 question = prompt[9:].strip()  # Remove "Question:" prefix
                 add_message("assistant", f"Searching for an answer to: '{question}'")
-               
-                # Search for relevant files
-                search_results = search_files(site_info['id'], question, headers)
-               
-                if search_results:
-                    # Download and read content of relevant files
-                    for item in search_results:
-                        file_content, file_name = download_file(site_info['id'], item['name'], headers)
-                        if file_content and file_name:
-                            content = read_file_content(file_content, file_name)
-                            st.session_state.file_contents[file_name] = content
-                   
-                    # Search for answer in the downloaded content
-                    answer = search_answer(question, st.session_state.file_contents)
-                    add_message("assistant", answer)
+                # Search for relevant files and read them in the background
+                if federated:
+                    start_question(question, None, graph, None, federated_sites(graph))
+                else:
+                    start_question(question, site_info['id'], graph, mirror)
+ 
+            elif folder_request := re.fullmatch(
+                    r"download\(\s*['\"]?(?:folder\s+)?(\d+(?:\.\d+)?)['\"]?\s*\)", prompt.strip(), re.IGNORECASE):
+                item_path, item_type = st.session_state.items_dict.get(folder_request.group(1), (None, None))
+                if item_type == 'Folder':
+                    download_folder(site_info['id'], item_path, graph)
+                    add_message(
+                        "assistant", "Is there anything else you'd like to do? (Yes/No)")
                 else:
-                    add_message("assistant", "I'm sorry, I couldn't find any relevant files to answer your question.")
+                    add_message(
+                        "assistant", "I'm sorry, the item number you provided is not a folder. Please check the item number and try again.")
  
             elif prompt.isdigit() or (prompt.replace('.', '').isdigit() and prompt.count('.') == 1):
                 item_path, item_type = st.session_state.items_dict.get(
@@ -367,15 +771,12 @@ else:
                         st.session_state.current_page = 1
                         st.rerun()
                     elif item_type == 'File':
-                        # Download the file
-                        file_content, file_name = download_file(
-                            site_info['id'], item_path, headers)
-                        if file_content and file_name:
+                        # Offer the file for download
+                        file_info = get_file_info(site_info['id'], graph, file_path=item_path)
+                        if file_info and '@microsoft.graph.downloadUrl' in file_info:
                             add_message(
-                                "assistant", f"Great! I've successfully downloaded '{file_name}' for you.")
-                            b64 = base64.b64encode(file_content).decode()
-                            href = f'<a href="data:application/octet-stream;base64,{b64}" download="{file_name}">Click here to download {file_name}</a>'
-                            st.markdown(href, unsafe_allow_html=True)
+                                "assistant", f"Great! '{file_info['name']}' is ready for you to download.")
+                            offer_download(file_info, graph)
                             add_message(
                                 "assistant", "Is there anything else you'd like to do? (Yes/No)")
                 else:
@@ -397,13 +798,28 @@ else:
                 query = prompt
                 add_message(
                     "assistant", f"Searching for files related to '{query}'...")
-                search_results = search_files(site_info['id'], query, headers)
+                if federated:
+                    search_results, failed_sites = federated_search(
+                        federated_sites(graph), query, graph, get_search_pool(), SEARCH_TIMEOUT_SECONDS,
+                        get_search_cache(), search_scope(), SHARED_SEARCH, SEARCH_MAX_RESULTS, SEARCH_CONCURRENCY)
+                    if failed_sites:
+                        add_message("assistant", failed_sites_message(failed_sites))
+                elif mirror:
+                    with span("search", mirror=True) as timing:
+                        search_results = mirror.search(query)
+                        timing["items"] = len(search_results)
+                else:
+                    search_results = search_files(
+                        site_info['id'], query, graph, get_search_cache(), search_scope(), SHARED_SEARCH,
+                        SEARCH_MAX_RESULTS)
  
                 if search_results:
                     search_results_list = [
-                        f"{idx + 1}. {item['name']} (File)" for idx, item in enumerate(search_results)]
+                        f"{idx + 1}. {item['name']} ({item['siteName'] if 'siteName' in item else 'File'})"
+                        for idx, item in enumerate(search_results)]
                     search_results_dict = {
-                        str(idx + 1): item['id'] for idx, item in enumerate(search_results)}
+                        str(idx + 1): (item.get('siteId') or site_info['id'], item['id'])
+                        for idx, item in enumerate(search_results)}
  
                     st.session_state.search_results_dict = search_results_dict
                     search_results_text = "\n".join(search_results_list)
@@ -416,34 +832,19 @@ else:
                     add_message(
                         "assistant", "No files found related to your query. Please try again with a different query.")
  
-                if st.session_state.get('search_results_dict') and prompt in st.session_state['search_results_dict']:
-                    file_id = st.session_state['search_results_dict'][prompt]
-                    file_info_url = f"https://graph.microsoft.com/v1.0/sites/{site_info['id']}/drive/items/{file_id}"
-                    file_info_response = requests.get(
-                        file_info_url, headers=headers)
- 
-                    if file_info_response.status_code == 200:
-                        file_info = file_info_response.json()
-                        file_name = file_info['name']
-                        download_url = file_info['@microsoft.graph.downloadUrl']
-                        file_content = requests.get(download_url).content
-                        add_message(
-                            "assistant", f"Great! I've successfully downloaded '{file_name}' for you.")
- 
-                        # Create a download button
-                        b64 = base64.b64encode(file_content).decode()
-                        href = f'<a href="data:application/octet-stream;base64,{b64}" download="{file_name}">Click here to download {file_name}</a>'
-                        st.markdown(href, unsafe_allow_html=True)
- 
-                        add_message(
-                            "assistant", "Is there anything else you'd like to do? (Yes/No)")
-                    else:
-                        add_message(
-                            "assistant", "I'm sorry, I couldn't retrieve the file information. Please try again.")
- 
+        # Follow the question being answered, or show the last answer
+        if st.session_state.get('question'):
+            show_question_progress()
+        elif st.session_state.get('last_answer'):
+            show_last_answer()
+
         # Add a button to clear the conversation
         if st.button("Clear Conversation"):
+            cancel_question()
             st.session_state.messages = []
+            # Release the session's documents and index along with the conversation
+            st.session_state.documents.clear()
+            st.session_state.search_index.clear()
             st.rerun()
  
 # To handle the redirection and capture the auth code
@@ -454,4 +855,6 @@ if 'auth_code' not in st.session_state and 'code' in st.query_params:
 if 'auth_url' in st.query_params:
     st.markdown(
         f'<meta http-equiv="refresh" content="0; url={st.query_params["auth_url"]}">', unsafe_allow_html=True)
+
+METRICS.observe("rerun", time.perf_counter() - run_start)
  
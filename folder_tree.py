@@ -0,0 +1,106 @@
+import threading
+import time
+
+from graph_client import BATCH_LIMIT
+
+
+class FolderTree:
+    # Lazily loaded, cached view of a drive's folders. Children are fetched one $top-sized
+    # Graph page at a time and kept by folder item id; folder metadata is kept by path and
+    # re-validated against the folder's eTag/cTag once its TTL has passed.
+
+    def __init__(self, graph, site_id, page_size=20, ttl=300):
+        self.graph = graph
+        self.site_id = site_id
+        self.page_size = page_size
+        self.ttl = ttl
+        self.lock = threading.RLock()
+        # path -> {"id", "tag", "child_count", "checked"}
+        self.folders = {}
+        # folder id -> {"items": [...], "next_link": url or None}
+        self.children_cache = {}
+        self.requests = 0
+
+    def drive_url(self, path):
+        base = f"https://graph.microsoft.com/v1.0/sites/{self.site_id}/drive"
+        return f"{base}/root:/{path}" if path else f"{base}/root"
+
+    def remember_folder(self, path, item):
+        tag = (item.get('eTag'), item.get('cTag'))
+        known = self.folders.get(path)
+        if known and (known["id"] != item['id'] or known["tag"] != tag):
+            self.children_cache.pop(known["id"], None)
+        self.folders[path] = {"id": item['id'], "tag": tag, "child_count": item.get('folder', {}).get('childCount'),
+                              "checked": time.monotonic()}
+
+    def folder(self, path):
+        with self.lock:
+            known = self.folders.get(path)
+            if known and time.monotonic() - known["checked"] < self.ttl:
+                return known
+            self.requests += 1
+            item = self.graph.get_json(self.drive_url(path))
+            if item is None:
+                return None
+            self.remember_folder(path, item)
+            return self.folders[path]
+
+    def store_page(self, path, entry, page):
+        entry["items"].extend(page.get('value', []))
+        entry["next_link"] = page.get('@odata.nextLink')
+        for item in page.get('value', []):
+            if 'folder' in item:
+                self.remember_folder(f"{path}/{item['name']}".lstrip("/"), item)
+
+    # Returns (loaded children, total child count, whether every child is loaded), fetching
+    # further pages only until at least `count` children are available
+    def children(self, path, count):
+        with self.lock:
+            folder = self.folder(path)
+            if folder is None:
+                return None, 0, False
+            entry = self.children_cache.get(folder["id"])
+            if entry is None:
+                self.requests += 1
+                page = self.graph.get_json(
+                    f"https://graph.microsoft.com/v1.0/sites/{self.site_id}/drive/items/{folder['id']}/children?$top={self.page_size}")
+                if page is None:
+                    return None, 0, False
+                entry = self.children_cache[folder["id"]] = {"items": [], "next_link": None}
+                self.store_page(path, entry, page)
+            while len(entry["items"]) < count and entry["next_link"]:
+                self.requests += 1
+                page = self.graph.get_json(entry["next_link"])
+                if page is None:
+                    break
+                self.store_page(path, entry, page)
+            complete = entry["next_link"] is None
+            total = len(entry["items"]) if complete else max(folder["child_count"] or 0, len(entry["items"]))
+            return entry["items"], total, complete
+
+    # Fetches the first page of up to BATCH_LIMIT subfolders in one $batch call
+    def prefetch(self, path, folders):
+        with self.lock:
+            missing = []
+            for item in folders:
+                known = self.folders.get(f"{path}/{item['name']}".lstrip("/"))
+                if known and known["id"] not in self.children_cache:
+                    missing.append(item)
+            missing = missing[:BATCH_LIMIT]
+            if not missing:
+                return
+            self.requests += 1
+            urls = [f"https://graph.microsoft.com/v1.0/sites/{self.site_id}/drive/items/{item['id']}/children?$top={self.page_size}"
+                    for item in missing]
+            for item, (status, body) in zip(missing, self.graph.batch(urls)):
+                if status == 200:
+                    entry = self.children_cache[item['id']] = {"items": [], "next_link": None}
+                    self.store_page(f"{path}/{item['name']}".lstrip("/"), entry, body)
+
+    def invalidate(self, path=None):
+        with self.lock:
+            if path is None:
+                self.folders.clear()
+                self.children_cache.clear()
+            elif path in self.folders:
+                self.children_cache.pop(self.folders.pop(path)["id"], None)
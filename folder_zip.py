@@ -0,0 +1,112 @@
+import concurrent.futures
+import itertools
+import os
+import shutil
+import tempfile
+import time
+import zipfile
+
+from graph_client import BATCH_LIMIT
+
+
+# Lists every file below a folder, breadth first, fetching the first page of up to BATCH_LIMIT
+# folders per $batch call. Returns [(path inside the folder, item)], or raises ValueError once
+# more than max_files files are found
+def walk_files(graph, site_id, folder_id, max_files):
+    files = []
+    pending = [(folder_id, "")]
+    while pending:
+        level, pending = pending[:BATCH_LIMIT], pending[BATCH_LIMIT:]
+        urls = [f"https://graph.microsoft.com/v1.0/sites/{site_id}/drive/items/{item_id}/children?$top=200"
+                for item_id, _ in level]
+        for (item_id, prefix), (status, body) in zip(level, graph.batch(urls)):
+            if status != 200:
+                raise RuntimeError(f"Couldn't list '{prefix or '/'}' (HTTP {status})")
+            values = body.get('value', [])
+            if body.get('@odata.nextLink'):
+                values = values + list(graph.iter_values(body['@odata.nextLink']))
+            for item in values:
+                path = f"{prefix}/{item['name']}".lstrip("/")
+                if 'folder' in item:
+                    pending.append((item['id'], path))
+                elif 'file' in item:
+                    files.append((path, item))
+            if len(files) > max_files:
+                raise ValueError(f"the folder has more than {max_files} files")
+    return files
+
+
+def download_to(graph, site_id, item, directory, max_bytes):
+    with tempfile.NamedTemporaryFile(dir=directory, delete=False) as f:
+        if '@microsoft.graph.downloadUrl' in item:
+            size = graph.download(item['@microsoft.graph.downloadUrl'], f, max_bytes, authenticate=False)
+        else:
+            size = graph.download(
+                f"https://graph.microsoft.com/v1.0/sites/{site_id}/drive/items/{item['id']}/content", f, max_bytes)
+    if size is None:
+        os.remove(f.name)
+        return None, 0
+    return f.name, size
+
+
+# Downloads files concurrently and adds each one to a ZIP archive on disk as soon as it
+# arrives, so neither the files nor the archive are held in memory. At most `window` downloads
+# are queued on the pool at a time, so a large folder doesn't hold up other users' downloads.
+# Calls progress(files_done, total_files, bytes_done, seconds) after every file and returns
+# (files written, bytes downloaded, paths that failed)
+def zip_files(graph, site_id, files, archive_path, download_pool, max_bytes, progress=None, window=4):
+    total_size = sum(item.get('size') or 0 for _, item in files)
+    if total_size > max_bytes:
+        raise ValueError(f"the folder holds {total_size / 1e6:.1f} MB, more than the {max_bytes / 1e6:.0f} MB limit")
+    start = time.monotonic()
+    done = 0
+    bytes_done = 0
+    failed = []
+    work_dir = tempfile.mkdtemp(prefix="folder-zip-")
+    queued = iter(files)
+    futures = {}
+    try:
+        with zipfile.ZipFile(archive_path, "w", zipfile.ZIP_DEFLATED) as archive:
+            while True:
+                for path, item in itertools.islice(queued, window - len(futures)):
+                    futures[download_pool.submit(download_to, graph, site_id, item, work_dir, max_bytes)] = path
+                if not futures:
+                    break
+                finished, _ = concurrent.futures.wait(futures, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in finished:
+                    path = futures.pop(future)
+                    try:
+                        file_path, size = future.result()
+                    except Exception:
+                        file_path, size = None, 0
+                    if file_path is None:
+                        failed.append(path)
+                    else:
+                        bytes_done += size
+                        if bytes_done > max_bytes:
+                            os.remove(file_path)
+                            raise ValueError(f"the folder holds more than the {max_bytes / 1e6:.0f} MB limit")
+                        archive.write(file_path, path)
+                        os.remove(file_path)
+                    done += 1
+                    if progress:
+                        progress(done, len(files), bytes_done, time.monotonic() - start)
+    finally:
+        for future in futures:
+            future.cancel()
+        concurrent.futures.wait(futures)
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return done - len(failed), bytes_done, failed
+
+
+# Removes the archives in a directory that are older than max_age seconds, whether or not the
+# session that made them is still around
+def remove_old_archives(directory, max_age):
+    cutoff = time.time() - max_age
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        try:
+            if name.endswith(".zip") and os.path.getmtime(path) < cutoff:
+                os.remove(path)
+        except OSError:
+            pass
@@ -0,0 +1,207 @@
+import random
+import re
+import threading
+import time
+import urllib.parse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+GRAPH_URL = "https://graph.microsoft.com/v1.0"
+
+# Graph answers these when it is throttling or briefly unavailable
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# Most requests Graph accepts in a single $batch call
+BATCH_LIMIT = 20
+
+
+def endpoint_name(url):
+    parts = urllib.parse.urlsplit(url)
+    if not parts.path.startswith("/v1.0/"):
+        return parts.netloc
+    path = parts.path[len("/v1.0"):]
+    path = re.sub(r"root:/.*?:(?=/|$)", "root:{path}:", path)
+    path = re.sub(r"/(sites|items)/[^/]+", r"/\1/{id}", path)
+    path = re.sub(r"search\(q=.*\)", "search", path)
+    return path
+
+
+class GraphClient:
+    # Microsoft Graph client on a pooled keep-alive session. Retries throttled and failed
+    # requests (honouring Retry-After), follows @odata.nextLink and keeps per-endpoint stats.
+
+    def __init__(self, headers=None, timeout=(5, 60), max_retries=4, max_retry_wait=60, pool_size=16, base_url=GRAPH_URL):
+        self.headers = headers or {}
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.max_retry_wait = max_retry_wait
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.lock = threading.Lock()
+        self.stats = {}
+
+    # headers may be a dict or a function returning the current one, such as a token store lookup
+    def auth_headers(self):
+        headers = self.headers() if callable(self.headers) else self.headers
+        return dict(headers or {})
+
+    def record(self, url, seconds, status):
+        name = endpoint_name(url)
+        with self.lock:
+            stats = self.stats.setdefault(name, {"requests": 0, "errors": 0, "throttled": 0, "seconds": 0.0, "max_seconds": 0.0})
+            stats["requests"] += 1
+            stats["seconds"] += seconds
+            stats["max_seconds"] = max(stats["max_seconds"], seconds)
+            if status is None or status >= 400:
+                stats["errors"] += 1
+            if status in RETRY_STATUSES or status is None:
+                stats["throttled"] += 1
+
+    def url(self, url):
+        if url.startswith(GRAPH_URL):
+            url = url[len(GRAPH_URL):]
+        if not url.startswith("http"):
+            url = self.base_url + url
+        return url
+
+    def relative_url(self, url):
+        for base in (GRAPH_URL, self.base_url):
+            if url.startswith(base):
+                return url[len(base):]
+        return url
+
+    def retry_wait(self, response, attempt):
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after is not None:
+            retry_after = str(retry_after)
+        if retry_after and retry_after.isdigit():
+            return min(int(retry_after), self.max_retry_wait)
+        return min(2 ** attempt + random.random(), self.max_retry_wait)
+
+    # With a deadline (a time.monotonic() value), each attempt's timeout is cut to the time left
+    # and no retry is made once the wait for it would pass the deadline
+    def request(self, method, url, authenticate=True, deadline=None, **kwargs):
+        url = self.url(url)
+        headers = self.auth_headers() if authenticate else {}
+        headers.update(kwargs.pop("headers", {}))
+        timeout = kwargs.pop("timeout", self.timeout)
+        for attempt in range(self.max_retries + 1):
+            kwargs["timeout"] = timeout
+            if deadline is not None:
+                left = max(deadline - time.monotonic(), 0.1)
+                kwargs["timeout"] = tuple(min(part, left) for part in timeout) if isinstance(timeout, tuple) else min(timeout, left)
+            start = time.perf_counter()
+            try:
+                response = self.session.request(method, url, headers=headers, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                self.record(url, time.perf_counter() - start, None)
+                wait = self.retry_wait(None, attempt)
+                if attempt == self.max_retries or (deadline is not None and time.monotonic() + wait >= deadline):
+                    raise
+                time.sleep(wait)
+                continue
+            self.record(url, time.perf_counter() - start, response.status_code)
+            wait = self.retry_wait(response, attempt)
+            if response.status_code not in RETRY_STATUSES or attempt == self.max_retries or (
+                    deadline is not None and time.monotonic() + wait >= deadline):
+                return response
+            response.close()
+            time.sleep(wait)
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    # Streams a response body into a binary file object instead of holding it in memory.
+    # Returns the number of bytes written, or None on an error status, when max_bytes is exceeded
+    # or once the `cancelled` event is set
+    def download(self, url, file, max_bytes=None, chunk_size=1024 * 1024, cancelled=None, **kwargs):
+        with self.get(url, stream=True, **kwargs) as response:
+            if response.status_code != 200:
+                return None
+            size = 0
+            for chunk in response.iter_content(chunk_size):
+                size += len(chunk)
+                if (max_bytes is not None and size > max_bytes) or (cancelled is not None and cancelled.is_set()):
+                    return None
+                file.write(chunk)
+        return size
+
+    def get_json(self, url, **kwargs):
+        response = self.get(url, **kwargs)
+        if response.status_code == 200:
+            return response.json()
+        return None
+
+    # Yields the 'value' entries of a collection across all of its @odata.nextLink pages
+    def iter_values(self, url, **kwargs):
+        while url:
+            page = self.get_json(url, **kwargs)
+            if page is None:
+                return
+            yield from page.get('value', [])
+            url = page.get('@odata.nextLink')
+
+    # Returns every entry of a collection, or None when the first page can't be fetched. With
+    # max_items or a deadline (a time.monotonic() value), no further page is fetched once that
+    # many entries are in or the deadline has passed, and no request runs past the deadline
+    def get_all(self, url, max_items=None, deadline=None, **kwargs):
+        kwargs["deadline"] = deadline
+        page = self.get_json(url, **kwargs)
+        if page is None:
+            return None
+        values = page.get('value', [])
+        next_link = page.get('@odata.nextLink')
+        while next_link and (max_items is None or len(values) < max_items) and (
+                deadline is None or time.monotonic() < deadline):
+            page = self.get_json(next_link, **kwargs)
+            if page is None:
+                break
+            values.extend(page.get('value', []))
+            next_link = page.get('@odata.nextLink')
+        return values if max_items is None else values[:max_items]
+
+    # Sends GET requests as $batch calls of up to BATCH_LIMIT each, retrying throttled
+    # sub-requests, and returns (status, body) for every url in the original order
+    def batch(self, urls):
+        results = [(None, None)] * len(urls)
+        pending = list(range(len(urls)))
+        for attempt in range(self.max_retries + 1):
+            throttled = []
+            wait = 0
+            for start in range(0, len(pending), BATCH_LIMIT):
+                chunk = pending[start:start + BATCH_LIMIT]
+                payload = {"requests": [
+                    {"id": str(index), "method": "GET", "url": self.relative_url(urls[index])} for index in chunk]}
+                response = self.request("POST", "/$batch", json=payload)
+                if response.status_code != 200:
+                    for index in chunk:
+                        results[index] = (response.status_code, None)
+                    continue
+                for sub_response in response.json().get("responses", []):
+                    index = int(sub_response["id"])
+                    status = sub_response.get("status")
+                    if status in RETRY_STATUSES and attempt < self.max_retries:
+                        throttled.append(index)
+                        wait = max(wait, self.retry_wait(_BatchResponse(sub_response), attempt))
+                    else:
+                        results[index] = (status, sub_response.get("body"))
+            if not throttled:
+                break
+            pending = sorted(throttled)
+            time.sleep(wait)
+        return results
+
+    def endpoint_stats(self):
+        with self.lock:
+            return {name: dict(stats) for name, stats in self.stats.items()}
+
+
+class _BatchResponse:
+    # Gives a $batch sub-response the .headers attribute retry_wait() expects
+
+    def __init__(self, sub_response):
+        self.headers = sub_response.get("headers") or {}
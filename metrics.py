@@ -0,0 +1,201 @@
+import collections
+import contextlib
+import contextvars
+import http.server
+import json
+import queue
+import sys
+import threading
+import time
+
+# Upper bounds, in seconds, of the latency histogram buckets
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# Id of the request (one script run or question) the current spans belong to, written with
+# every JSON line so a slow request's stages can be read together
+REQUEST = contextvars.ContextVar("request", default=None)
+
+
+class Metrics:
+    # Timing spans per stage (auth, site, listing, search, download, parse, index, score, ...)
+    # aggregated into latency histograms with byte, item and error totals. Exported in the
+    # Prometheus text format, and optionally appended to a JSON lines file span by span.
+
+    def __init__(self, buckets=BUCKETS, prefix="buddybot"):
+        self.buckets = buckets
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        self.stages = {}
+        self.lines = None
+        self.server = None
+
+    @contextlib.contextmanager
+    def span(self, stage, **fields):
+        # Callers add to span["bytes"] and span["items"] while the span is open
+        record = {"bytes": 0, "items": 0}
+        record.update(fields)
+        start = time.perf_counter()
+        error = False
+        try:
+            yield record
+        except BaseException as e:
+            # A rerun or stop isn't a failure of the stage
+            error = type(e).__name__ not in ("RerunException", "StopException")
+            raise
+        finally:
+            self.observe(stage, time.perf_counter() - start, record.pop("bytes"), record.pop("items"), error, **record)
+
+    def observe(self, stage, seconds, bytes=0, items=0, error=False, **fields):
+        with self.lock:
+            stats = self.stages.get(stage)
+            if stats is None:
+                stats = self.stages[stage] = {"buckets": [0] * len(self.buckets), "count": 0, "seconds": 0.0,
+                                              "bytes": 0, "items": 0, "errors": 0}
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    stats["buckets"][i] += 1
+                    break
+            stats["count"] += 1
+            stats["seconds"] += seconds
+            stats["bytes"] += bytes
+            stats["items"] += items
+            stats["errors"] += int(error)
+        if self.lines is not None:
+            self.lines.put(dict(fields, time=time.time(), request=REQUEST.get(), stage=stage, seconds=round(seconds, 6),
+                                bytes=bytes, items=items, error=error))
+
+    # Appends every span to a JSON lines file from a background thread, so spans only queue
+    # their line; the file stays open and is flushed whenever the queue runs empty
+    def write_jsonl(self, path):
+        if self.lines is not None:
+            return
+        self.lines = queue.SimpleQueue()
+        threading.Thread(target=self.jsonl_writer, args=(path,), daemon=True).start()
+
+    def jsonl_writer(self, path):
+        with open(path, "a", encoding="utf-8") as f:
+            while True:
+                line = self.lines.get()
+                f.write(json.dumps(line, default=str) + "\n")
+                if self.lines.empty():
+                    f.flush()
+
+    def snapshot(self):
+        with self.lock:
+            return {stage: dict(stats, buckets=list(stats["buckets"])) for stage, stats in self.stages.items()}
+
+    def prometheus(self):
+        name = f"{self.prefix}_stage"
+        lines = [f"# HELP {name}_seconds Time spent per request stage.", f"# TYPE {name}_seconds histogram"]
+        totals = []
+        for stage, stats in sorted(self.snapshot().items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, stats["buckets"]):
+                cumulative += count
+                lines.append(f'{name}_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+            lines.append(f'{name}_seconds_bucket{{stage="{stage}",le="+Inf"}} {stats["count"]}')
+            lines.append(f'{name}_seconds_sum{{stage="{stage}"}} {stats["seconds"]}')
+            lines.append(f'{name}_seconds_count{{stage="{stage}"}} {stats["count"]}')
+            totals.append((stage, stats))
+        for total in ("bytes", "items", "errors"):
+            lines.append(f"# TYPE {name}_{total}_total counter")
+            lines.extend(f'{name}_{total}_total{{stage="{stage}"}} {stats[total]}' for stage, stats in totals)
+        return "\n".join(lines) + "\n"
+
+    # Serves the Prometheus text on http://host:port/metrics from a background thread
+    def serve(self, port, host="0.0.0.0"):
+        if self.server is not None:
+            return self.server
+        metrics = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.prometheus().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self.server = http.server.ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self.server
+
+
+# Process-wide metrics shared by every session, like a Prometheus client's default registry
+METRICS = Metrics()
+
+
+def span(stage, **fields):
+    return METRICS.span(stage, **fields)
+
+
+def observe(stage, seconds, bytes=0, items=0, error=False, **fields):
+    METRICS.observe(stage, seconds, bytes, items, error, **fields)
+
+
+# Wraps a function handed to a worker thread so its spans keep the caller's request id
+def bind_request(function):
+    request = REQUEST.get()
+
+    def run(*args, **kwargs):
+        token = REQUEST.set(request)
+        try:
+            return function(*args, **kwargs)
+        finally:
+            REQUEST.reset(token)
+    return run
+
+
+class SamplingProfiler:
+    # Samples the stack of the thread that entered it every `interval` seconds from a background
+    # thread, so a single question can be profiled with little overhead. Work done in the
+    # download threads and parser processes shows up as the waits that cover it.
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self.samples = 0
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.thread_id = None
+
+    def __enter__(self):
+        self.thread_id = threading.get_ident()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop_event.set()
+        self.thread.join()
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]}:{frame.f_lineno})")
+                frame = frame.f_back
+            self.stacks[tuple(reversed(stack))] += 1
+            self.samples += 1
+
+    # Functions by the share of samples they were on the stack for
+    def top(self, limit=20):
+        inclusive = collections.Counter()
+        for stack, count in self.stacks.items():
+            for function in set(frame.rsplit(":", 1)[0] for frame in stack):
+                inclusive[function] += count
+        return [(function, count / max(self.samples, 1)) for function, count in inclusive.most_common(limit)]
+
+    # Stacks in the collapsed format flame graph tools read
+    def collapsed(self):
+        return "\n".join(f"{';'.join(stack)} {count}" for stack, count in self.stacks.most_common())
@@ -0,0 +1,37 @@
+import os
+import pickle
+import sys
+
+from pipeline import read_message, send_message
+
+
+# Entry script of a parser process started by pipeline.ParserPool. Tasks arrive on stdin and
+# results go back on stdout, one pickled message each
+def main():
+    tasks = sys.stdin.buffer
+    # Results keep their own copy of stdout, and anything a parsing library prints goes to stderr
+    results = os.fdopen(os.dup(1), "wb")
+    os.dup2(2, 1)
+    sys.path[:] = pickle.loads(read_message(tasks))
+    initializer = pickle.loads(read_message(tasks))
+    if initializer is not None:
+        initializer()
+    while True:
+        try:
+            message = read_message(tasks)
+        except EOFError:
+            return
+        try:
+            function, args, kwargs = pickle.loads(message)
+            result = (True, function(*args, **kwargs))
+        except Exception as e:
+            result = (False, e)
+        try:
+            message = pickle.dumps(result, pickle.HIGHEST_PROTOCOL)
+        except Exception as e:
+            message = pickle.dumps((False, RuntimeError(f"Parser result could not be sent back: {e}")))
+        send_message(results, message)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+import concurrent.futures
+import os
+import pickle
+import queue
+import subprocess
+import sys
+import threading
+import time
+
+# The script parser processes run
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "parse_worker.py")
+
+# How often a cancellable download_and_parse checks whether it was cancelled
+CANCEL_CHECK_SECONDS = 0.1
+
+
+class ParserPool:
+    # Parser processes started from their own entry script, parse_worker.py, rather than forked
+    # or spawned from the server: they import neither the app's script nor anything else the
+    # server has loaded, and inherit none of its threads or held locks. Each worker is fed by one
+    # thread of the pool. A worker that dies (a crash on a bad file, an out-of-memory kill) fails
+    # only the task it was running and is started again for the next one.
+
+    def __init__(self, max_workers=2, initializer=None):
+        self.initializer = initializer
+        self.tasks = queue.SimpleQueue()
+        self.lock = threading.Lock()
+        self.closed = False
+        self.restarts = 0
+        self.threads = [threading.Thread(target=self.feed, daemon=True) for _ in range(max_workers)]
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, function, *args, **kwargs):
+        with self.lock:
+            if self.closed:
+                raise RuntimeError("cannot schedule new parses after shutdown")
+        future = concurrent.futures.Future()
+        self.tasks.put((future, pickle.dumps((function, args, kwargs), pickle.HIGHEST_PROTOCOL)))
+        return future
+
+    def start_worker(self):
+        worker = subprocess.Popen([sys.executable, WORKER_SCRIPT], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        send_message(worker.stdin, pickle.dumps(sys.path))
+        send_message(worker.stdin, pickle.dumps(self.initializer))
+        return worker
+
+    def stop_worker(self, worker):
+        worker.kill()
+        worker.wait()
+        with self.lock:
+            self.restarts += 1
+
+    def feed(self):
+        worker = self.start_worker()
+        try:
+            while True:
+                task = self.tasks.get()
+                if task is None:
+                    return
+                future, message = task
+                if not future.set_running_or_notify_cancel():
+                    continue
+                # A worker that died while it was idle is started again before it gets the task
+                if worker is not None and worker.poll() is not None:
+                    worker = self.stop_worker(worker)
+                if worker is None:
+                    worker = self.start_worker()
+                try:
+                    send_message(worker.stdin, message)
+                    ok, result = pickle.loads(read_message(worker.stdout))
+                except (OSError, EOFError):
+                    worker = self.stop_worker(worker)
+                    future.set_exception(concurrent.futures.BrokenExecutor(
+                        "A parser process terminated abruptly"))
+                    continue
+                if ok:
+                    future.set_result(result)
+                else:
+                    future.set_exception(result)
+        finally:
+            if worker is not None:
+                worker.stdin.close()
+                worker.wait()
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        with self.lock:
+            self.closed = True
+        while cancel_futures:
+            try:
+                task = self.tasks.get_nowait()
+            except queue.Empty:
+                break
+            task[0].cancel()
+        for _ in self.threads:
+            self.tasks.put(None)
+        if wait:
+            for thread in self.threads:
+                thread.join()
+
+
+# Messages between the pool and its workers: a length, then the pickled bytes
+def send_message(stream, message):
+    stream.write(len(message).to_bytes(8, "little"))
+    stream.write(message)
+    stream.flush()
+
+
+def read_message(stream):
+    size = stream.read(8)
+    if len(size) < 8:
+        raise EOFError
+    size = int.from_bytes(size, "little")
+    message = stream.read(size)
+    if len(message) < size:
+        raise EOFError
+    return message
+
+
+def timed_parse(parse, file_content, file_name):
+    start = time.perf_counter()
+    return parse(file_content, file_name), time.perf_counter() - start
+
+
+def download_and_parse(items, download, parse, download_pool, parse_pool, deadline=None, cancelled=None):
+    # Downloads run on a thread pool and parsing on a process pool, so one file can be parsed
+    # while others are still downloading. Results are yielded as soon as each file is ready as
+    # (item, file_name, file_content, text, parse_seconds, error); whatever is still pending
+    # when the deadline (a time.monotonic() value) passes, or once the `cancelled` event is set,
+    # is cancelled.
+    # download(item) returns (file_name, file_content, cached_text); cached_text skips parsing.
+    pending = {download_pool.submit(download, item): ("download", item, None, None) for item in items}
+    try:
+        while pending:
+            timeout = None if deadline is None else deadline - time.monotonic()
+            if timeout is not None and timeout <= 0:
+                break
+            if cancelled is not None:
+                if cancelled.is_set():
+                    break
+                # Wake up regularly to notice a cancellation
+                timeout = CANCEL_CHECK_SECONDS if timeout is None else min(timeout, CANCEL_CHECK_SECONDS)
+            done, _ = concurrent.futures.wait(pending, timeout=timeout, return_when=concurrent.futures.FIRST_COMPLETED)
+            if not done:
+                continue
+            for future in done:
+                stage, item, file_name, file_content = pending.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    yield item, file_name, file_content, None, 0.0, e
+                    continue
+                if stage == "download":
+                    file_name, file_content, cached_text = result
+                    if not file_name:
+                        continue
+                    if cached_text is not None:
+                        yield item, file_name, None, cached_text, 0.0, None
+                        continue
+                    future = parse_pool.submit(timed_parse, parse, file_content, file_name)
+                    pending[future] = ("parse", item, file_name, file_content)
+                else:
+                    text, parse_seconds = result
+                    yield item, file_name, file_content, text, parse_seconds, None
+    finally:
+        for future in pending:
+            future.cancel()
@@ -0,0 +1,87 @@
+import threading
+
+
+class QuestionJob:
+    # One question being answered in the background. The work function adds each document
+    # it brings in with add_document(item, name, chunks); sessions following the job read
+    # them with documents_since(cursor) and index them themselves. The job is cancelled once
+    # every session following it has unsubscribed. `owner` is whoever started it.
+
+    def __init__(self, key, owner=None):
+        self.key = key
+        self.owner = owner
+        self.lock = threading.Lock()
+        self.cancelled = threading.Event()
+        self.finished = threading.Event()
+        self.subscribers = set()
+        self.documents = []
+        self.search_results = None
+        self.failed_sites = []
+        self.completed = True
+        self.errors = []
+        self.error = None
+        self.profiler = None
+
+    def add_document(self, item, name, chunks):
+        if self.cancelled.is_set():
+            return
+        with self.lock:
+            self.documents.append((item, name, chunks))
+
+    def documents_since(self, cursor):
+        with self.lock:
+            return self.documents[cursor:]
+
+    def subscribe(self, subscriber):
+        with self.lock:
+            if self.finished.is_set() or self.cancelled.is_set():
+                return False
+            self.subscribers.add(subscriber)
+            return True
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            self.subscribers.discard(subscriber)
+            if not self.subscribers:
+                self.cancelled.set()
+
+    def done(self):
+        return self.finished.is_set()
+
+
+class QuestionJobs:
+    # Runs question jobs on a thread pool. Submitting a question while an identical one (same
+    # key) is still running joins that job instead of starting another.
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.lock = threading.Lock()
+        self.jobs = {}
+        self.joined = 0
+
+    def submit(self, key, work, subscriber, owner=None):
+        with self.lock:
+            job = self.jobs.get(key)
+            if job is not None and job.subscribe(subscriber):
+                self.joined += 1
+                return job
+            job = self.jobs[key] = QuestionJob(key, owner)
+            job.subscribe(subscriber)
+        self.pool.submit(self.run, job, work)
+        return job
+
+    def run(self, job, work):
+        try:
+            if not job.cancelled.is_set():
+                work(job)
+        except Exception as e:
+            job.error = e
+        finally:
+            with self.lock:
+                if self.jobs.get(job.key) is job:
+                    del self.jobs[job.key]
+            job.finished.set()
+
+    def running(self):
+        with self.lock:
+            return len(self.jobs)
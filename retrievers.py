@@ -0,0 +1,24 @@
+import importlib
+
+# Every retriever indexes documents as sentences and shares SentenceIndex's interface:
+# add_chunks(doc, chunks), add_document(doc, text), remove_document(doc), clear(), documents(),
+# len(), `doc in index`, document_bytes(doc), the memory the index holds for a document, and
+# search(question, top_k, threshold) -> [(score, sentence, doc)].
+# Each entry gives the retriever's module and class, imported on first use so numpy is only
+# loaded when the embedding backend is chosen, and the score a sentence must beat to be used
+# in an answer, since the scorers' scales differ.
+RETRIEVERS = {
+    "tfidf": ("search_index", "SentenceIndex", 0.2),
+    "embedding": ("embedding_index", "EmbeddingIndex", 0.1),
+}
+
+
+def make_retriever(name="tfidf", **options):
+    if name not in RETRIEVERS:
+        raise ValueError(f"Unknown retriever '{name}', expected one of: {', '.join(RETRIEVERS)}")
+    module, class_name, _ = RETRIEVERS[name]
+    return getattr(importlib.import_module(module), class_name)(**options)
+
+
+def answer_threshold(name="tfidf"):
+    return RETRIEVERS[name][2]
@@ -0,0 +1,43 @@
+import collections
+import threading
+import time
+
+
+class SearchCache:
+    # Search results shared by all sessions, kept for `ttl` seconds so a query repeated
+    # within that time costs no Graph call. Holds at most max_entries, dropping the least
+    # recently used first.
+
+    def __init__(self, ttl=300, max_entries=1000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.counters = collections.Counter()
+        # key -> (results, time stored)
+        self.entries = collections.OrderedDict()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or time.monotonic() - entry[1] > self.ttl:
+                self.entries.pop(key, None)
+                self.counters["misses"] += 1
+                return None
+            self.entries.move_to_end(key)
+            self.counters["hits"] += 1
+            return entry[0]
+
+    def put(self, key, results):
+        with self.lock:
+            self.entries[key] = (results, time.monotonic())
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters)
+            stats["entries"] = len(self.entries)
+        for key in ("hits", "misses"):
+            stats.setdefault(key, 0)
+        return stats
@@ -0,0 +1,177 @@
+import heapq
+import math
+import re
+import sys
+
+TOKEN_PATTERN = re.compile(r"(?u)\b\w\w+\b")
+
+# Approximate bytes the index holds per sentence (its entry, id and norm), per posting and per
+# distinct term, besides the strings and count dicts themselves; measured with tracemalloc
+SENTENCE_BYTES = 250
+POSTING_BYTES = 85
+TERM_BYTES = 350
+
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+class SentenceIndex:
+    # Inverted TF-IDF index over sentences, built incrementally as files are ingested.
+    # Scores match sklearn's TfidfVectorizer (smooth idf, l2 norm) without refitting.
+
+    def __init__(self, candidate_budget=1000, norm_tolerance=0.1):
+        self.candidate_budget = candidate_budget
+        self.norm_tolerance = norm_tolerance
+        self.postings = {}
+        # Per term, the smallest ratio of a sentence's other squared term counts to the term's own
+        # squared count among the sentences it occurs in; it bounds what the term adds to a score
+        self.rest = {}
+        self.sentences = {}
+        self.doc_sentences = {}
+        # Estimated bytes each document's sentences hold in the index
+        self.doc_bytes = {}
+        self.next_id = 0
+
+    def __len__(self):
+        return len(self.sentences)
+
+    def __contains__(self, doc_name):
+        return doc_name in self.doc_sentences
+
+    def documents(self):
+        return list(self.doc_sentences)
+
+    def document_bytes(self, doc_name):
+        return self.doc_bytes.get(doc_name, 0)
+
+    def add_document(self, doc_name, content):
+        self.add_chunks(doc_name, [content])
+
+    # Indexes a document from text chunks as they arrive, joining sentences split across chunks
+    def add_chunks(self, doc_name, chunks):
+        if doc_name in self.doc_sentences:
+            self.remove_document(doc_name)
+        sentence_ids = []
+        self.doc_sentences[doc_name] = sentence_ids
+        self.doc_bytes[doc_name] = 0
+        tail = ""
+        for chunk in chunks:
+            parts = (tail + " " + chunk).split('.')
+            tail = parts.pop()
+            for part in parts:
+                self.add_sentence(doc_name, part.strip(), sentence_ids)
+        self.add_sentence(doc_name, tail.strip(), sentence_ids)
+
+    def add_sentence(self, doc_name, sentence, sentence_ids):
+        if sentence:
+            counts = {}
+            for term in tokenize(sentence):
+                counts[term] = counts.get(term, 0) + 1
+            if not counts:
+                return
+            sentence_id = self.next_id
+            self.next_id += 1
+            # [text, document, term counts, cached norm, corpus size the norm was computed at]
+            self.sentences[sentence_id] = [sentence, doc_name, counts, 0.0, 0]
+            total = sum(count * count for count in counts.values())
+            size = sys.getsizeof(sentence) + sys.getsizeof(counts) + SENTENCE_BYTES + POSTING_BYTES * len(counts)
+            for term, count in counts.items():
+                if term not in self.postings:
+                    self.postings[term] = {}
+                    size += sys.getsizeof(term) + TERM_BYTES
+                self.postings[term][sentence_id] = count
+                rest = (total - count * count) / (count * count)
+                if rest < self.rest.get(term, math.inf):
+                    self.rest[term] = rest
+            sentence_ids.append(sentence_id)
+            self.doc_bytes[doc_name] += size
+
+    def remove_document(self, doc_name):
+        self.doc_bytes.pop(doc_name, None)
+        for sentence_id in self.doc_sentences.pop(doc_name, []):
+            _, _, counts, _, _ = self.sentences.pop(sentence_id)
+            for term in counts:
+                posting = self.postings[term]
+                del posting[sentence_id]
+                if not posting:
+                    del self.postings[term]
+                    del self.rest[term]
+
+    def clear(self):
+        self.postings.clear()
+        self.rest.clear()
+        self.sentences.clear()
+        self.doc_sentences.clear()
+        self.doc_bytes.clear()
+
+    def idf(self, term):
+        n = len(self.sentences)
+        return math.log((1 + n) / (1 + len(self.postings.get(term, ())))) + 1
+
+    def sentence_norm(self, sentence_id):
+        entry = self.sentences[sentence_id]
+        n = len(self.sentences)
+        # IDF drifts slowly as the corpus grows, so norms are only refreshed once it has moved enough
+        if not entry[4] or abs(n - entry[4]) > self.norm_tolerance * entry[4]:
+            entry[3] = math.sqrt(sum((count * self.idf(term)) ** 2 for term, count in entry[2].items()))
+            entry[4] = n
+        return entry[3]
+
+    def search(self, question, top_k=10, threshold=0.0):
+        query_counts = {}
+        for term in tokenize(question):
+            if term in self.postings:
+                query_counts[term] = query_counts.get(term, 0) + 1
+        if not query_counts:
+            return []
+
+        idfs = {term: self.idf(term) for term in query_counts}
+        query_norm = math.sqrt(sum((count * idfs[term]) ** 2 for term, count in query_counts.items()))
+        # Per-term factor of the dot product: query tf-idf weight times the sentence's idf
+        factors = {term: count * idfs[term] ** 2 for term, count in query_counts.items()}
+
+        # Max-score: terms are visited by the most they can add to any sentence's score, largest
+        # first, and each sentence in a visited term's posting is scored in full. Once what the
+        # unvisited terms could add up to can't beat the k-th best score (or the threshold), no
+        # sentence that only they contain can make the results, so their postings are skipped.
+        # Every idf is at least 1, so a sentence's norm is at least sqrt((count * idf)^2 + the
+        # other terms' squared counts). At most candidate_budget sentences are scored, which
+        # keeps latency flat once postings outgrow it; postings are read newest first, so the
+        # files just fetched for a question are never crowded out by older ones
+        limits = {term: factors[term] / (query_norm * math.sqrt(idfs[term] ** 2 + self.rest[term]))
+                  for term in query_counts}
+        terms = sorted(query_counts, key=limits.get, reverse=True)
+        remaining = [0.0] * (len(terms) + 1)
+        for position in range(len(terms) - 1, -1, -1):
+            remaining[position] = remaining[position + 1] + limits[terms[position]]
+
+        top = []
+        seen = set()
+        for position, term in enumerate(terms):
+            floor = top[0][0] if len(top) >= top_k else threshold
+            if remaining[position] <= floor or len(seen) >= self.candidate_budget:
+                break
+            # Sentences holding an earlier term were scored already, so only the later terms count
+            later = [(other, factors[other]) for other in terms[position:]]
+            for sentence_id in reversed(self.postings[term]):
+                if sentence_id in seen:
+                    continue
+                if len(seen) >= self.candidate_budget:
+                    break
+                seen.add(sentence_id)
+                counts = self.sentences[sentence_id][2]
+                dot = sum(factor * counts[other] for other, factor in later if other in counts)
+                score = dot / (query_norm * self.sentence_norm(sentence_id))
+                if score <= threshold:
+                    continue
+                if len(top) < top_k:
+                    heapq.heappush(top, (score, sentence_id))
+                elif score > top[0][0]:
+                    heapq.heapreplace(top, (score, sentence_id))
+
+        results = []
+        for score, sentence_id in sorted(top, reverse=True):
+            sentence, doc_name = self.sentences[sentence_id][:2]
+            results.append((score, sentence, doc_name))
+        return results
@@ -0,0 +1,371 @@
+import collections
+import concurrent.futures
+import functools
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+
+from extract import extract_text, extract_file
+from graph_client import BATCH_LIMIT
+from metrics import span, observe, bind_request
+from pipeline import download_and_parse
+
+# The SharePoint host sites are looked up on
+SHAREPOINT_HOST = "novintix.sharepoint.com"
+
+# Define items per page
+ITEMS_PER_PAGE = 20
+
+# Number of best-scoring sentences used to build an answer
+TOP_K_SENTENCES = 20
+
+# Damping constant of reciprocal rank fusion: a hit ranked r in a list scores 1 / (RRF_K + r)
+RRF_K = 60
+
+
+def get_site(graph, site_name, host=SHAREPOINT_HOST):
+    with span("site"):
+        return graph.get_json(f'https://graph.microsoft.com/v1.0/sites/{host}:/sites/{site_name}')
+
+
+# Returns (name, web URL, id) for every site the user can access
+def list_accessible_sites(graph):
+    sites_url = "https://graph.microsoft.com/v1.0/sites?search=*"
+    with span("site") as timing:
+        sites = graph.get_all(sites_url) or []
+        timing["items"] = len(sites)
+    return [(site['name'], site['webUrl'], site['id']) for site in sites]
+
+
+# Lists a folder far enough to show `count` items, returning the loaded items, the folder's
+# total item count and whether every item is loaded
+def list_items(tree, path="", count=ITEMS_PER_PAGE, mirror=None, page_size=ITEMS_PER_PAGE):
+    with span("listing", mirror=bool(mirror)) as timing:
+        if mirror:
+            items = mirror.children(path)
+            total, complete = len(items), True
+        else:
+            items, total, complete = tree.children(path, count)
+        timing["items"] = len(items or [])
+    if items is None:
+        return [], 0, False
+    if not items:
+        # Return a special item to indicate empty folder/site
+        return [("empty", "", "This folder/site is empty", "Empty", "")], 0, True
+    if not mirror:
+        # Opening any of the visible subfolders next shouldn't need another round trip
+        tree.prefetch(path, [item for item in items[count - page_size:count] if 'file' not in item])
+    items_list = []
+    for idx, item in enumerate(items, start=1):
+        item_type = 'File' if 'file' in item else 'Folder'
+        full_path = f"{path}/{item['name']}".lstrip("/")
+        items_list.append(
+            (str(idx), full_path, f"{idx}. {item['name']} ({item_type})", item_type, item['id']))
+    return items_list, total, complete
+
+
+# Metadata of a file, including its downloadUrl, by path or by item id
+def get_file_info(site_id, graph, file_path=None, file_id=None):
+    if file_id:
+        return graph.get_json(f"https://graph.microsoft.com/v1.0/sites/{site_id}/drive/items/{file_id}")
+    return graph.get_json(f"https://graph.microsoft.com/v1.0/sites/{site_id}/drive/root:/{file_path}")
+
+
+# Streams a file into a spooled temporary file, using the shared file cache when it is current.
+# Returns None when the download fails or grows past max_bytes
+def download_file(file_info, graph, file_cache, spool_bytes=8 * 1024 * 1024, max_bytes=None):
+    f = tempfile.SpooledTemporaryFile(max_size=spool_bytes)
+    with span("download", cached=False) as timing:
+        if file_cache.copy_content(file_info['id'], file_info.get('eTag'), f) is None:
+            if graph.download(file_info['@microsoft.graph.downloadUrl'], f, max_bytes, authenticate=False) is None:
+                f.close()
+                return None
+            file_cache.put_file(file_info['id'], file_info.get('eTag'), file_info['name'], f)
+        else:
+            timing["cached"] = True
+        timing["bytes"], timing["items"] = f.tell(), 1
+    f.seek(0)
+    return f
+
+
+# Searches a site's drive for at most max_results hits, fetching no further result pages once
+# the deadline (a time.monotonic() value) has passed. With a SearchCache, results are reused
+# for its TTL; cache_scope separates what different callers (for instance users) may share.
+# With check_access, hits taken from the cache are first checked against the caller's own
+# token, for a scope shared by several users
+def search_files(site_id, query, graph, cache=None, cache_scope=None, check_access=False, max_results=200,
+                 deadline=None):
+    key = (cache_scope, site_id, " ".join(query.lower().split()), max_results)
+    if cache is not None:
+        cached = cache.get(key)
+        if cached is not None:
+            return accessible_items(site_id, cached, graph) if check_access else cached
+    search_url = f"https://graph.microsoft.com/v1.0/sites/{site_id}/drive/root/search(q='{query}')"
+    with span("search") as timing:
+        results = graph.get_all(search_url, max_results, deadline)
+        timing["items"] = len(results or [])
+    if results is None:
+        return []
+    # Results cut short by the deadline aren't kept
+    if cache is not None and (deadline is None or time.monotonic() < deadline):
+        cache.put(key, results)
+    return results
+
+
+# Searches several sites, given as [(site id, site name)], at most `concurrency` at a time on
+# the shared pool, and merges their hits into one ranked list of at most max_results. Each hit is
+# a copy tagged with its siteId and siteName. A site's `timeout` seconds start when a worker
+# picks its search up, and also bound its Graph requests, so a site waiting behind other
+# searches isn't timed out unsearched and a slow one frees its worker. Sites that fail, time
+# out or haven't been searched by the deadline (a time.monotonic() value) are left out and
+# returned by name; a timed out search still fills the cache if it finishes
+def federated_search(sites, query, graph, pool, timeout=10, cache=None, cache_scope=None, check_access=False,
+                     max_results=200, concurrency=4, deadline=None):
+    started = {}
+
+    def search_site(site_id):
+        started[site_id] = time.monotonic()
+        return search_files(site_id, query, graph, cache, cache_scope, check_access, max_results,
+                            started[site_id] + timeout)
+
+    search_site = bind_request(search_site)
+    queued = list(sites)
+    running = {}
+    results = {}
+    failed = []
+    with span("search", sites=len(sites)) as timing:
+        while queued or running:
+            while queued and len(running) < concurrency:
+                site_id, site_name = queued.pop(0)
+                running[pool.submit(search_site, site_id)] = (site_id, site_name)
+            now = time.monotonic()
+            if deadline is not None and now >= deadline:
+                break
+            # Wait for a search to finish or for the first started one to run out of time
+            ends = [started[site_id] + timeout for site_id, _ in running.values() if site_id in started]
+            wait = min(ends, default=now + timeout) - now
+            if deadline is not None:
+                wait = min(wait, deadline - now)
+            done, _ = concurrent.futures.wait(running, timeout=max(wait, 0),
+                                              return_when=concurrent.futures.FIRST_COMPLETED)
+            now = time.monotonic()
+            for future, (site_id, site_name) in list(running.items()):
+                if future in done:
+                    del running[future]
+                    if future.exception() is None:
+                        results[site_id] = future.result()
+                    else:
+                        failed.append(site_name)
+                elif site_id in started and now >= started[site_id] + timeout:
+                    del running[future]
+                    failed.append(site_name)
+        for future, (_, site_name) in running.items():
+            future.cancel()
+            failed.append(site_name)
+        failed.extend(site_name for _, site_name in queued)
+        ranked_lists = [[dict(item, siteId=site_id, siteName=site_name) for item in results[site_id]]
+                        for site_id, site_name in sites if site_id in results]
+        merged = merge_ranked(ranked_lists, query)[:max_results]
+        timing["items"] = len(merged)
+    return merged, failed
+
+
+# Reciprocal rank fusion of two rankings: each hit's rank within its own site's results, and
+# its rank across all sites by how many query terms its name contains (hits with equal
+# matches share a rank). The sites' best hits come first, ordered by how well they match
+def merge_ranked(ranked_lists, query, k=RRF_K):
+    terms = set(re.findall(r"\w\w+", query.lower()))
+    hits = [item for ranked in ranked_lists for item in ranked]
+    matches = [len(terms & set(re.findall(r"\w\w+", item['name'].lower()))) for item in hits]
+    # A hit's name rank is one more than the number of hits matching more terms than it does
+    name_ranks = {}
+    better = 0
+    for count, hits_with_count in sorted(collections.Counter(matches).items(), reverse=True):
+        name_ranks[count] = 1 + better
+        better += hits_with_count
+    scores = []
+    position = 0
+    for ranked in ranked_lists:
+        for rank in range(1, len(ranked) + 1):
+            scores.append(1 / (k + rank) + 1 / (k + name_ranks[matches[position]]))
+            position += 1
+    order = sorted(range(len(hits)), key=lambda i: -scores[i])
+    return [hits[i] for i in order]
+
+
+# Returns the file's text, or "" when it can't be parsed
+def read_file_content(file_content, file_name):
+    try:
+        return extract_text(file_content, file_name)
+    except Exception:
+        return ""
+
+
+# The items the caller's own token can read, checked with $batch; for hits or text that were
+# fetched on behalf of another user
+def accessible_items(site_id, items, graph):
+    urls = [f"https://graph.microsoft.com/v1.0/sites/{item.get('siteId', site_id)}/drive/items/{item['id']}?$select=id"
+            for item in items]
+    return [item for item, (status, _) in zip(items, graph.batch(urls)) if status == 200]
+
+
+# Looks up the download URLs of many items with $batch instead of one request per item,
+# stopping between $batch calls once the deadline passes or `cancelled` is set
+def get_download_urls(site_id, items, graph, deadline=None, cancelled=None):
+    download_urls = {}
+    for start in range(0, len(items), BATCH_LIMIT):
+        if (deadline is not None and time.monotonic() >= deadline) or (cancelled is not None and cancelled.is_set()):
+            break
+        chunk = items[start:start + BATCH_LIMIT]
+        # Hits from a federated search carry the site they came from
+        urls = [f"https://graph.microsoft.com/v1.0/sites/{item.get('siteId', site_id)}/drive/items/{item['id']}"
+                for item in chunk]
+        for item, (status, body) in zip(chunk, graph.batch(urls)):
+            if status == 200 and '@microsoft.graph.downloadUrl' in body:
+                download_urls[item['id']] = body['@microsoft.graph.downloadUrl']
+    return download_urls
+
+
+# Streams a search hit into a temporary file, so parsers read it from disk in pages or row batches.
+# The download is abandoned at its next chunk once `stopped` is set
+def download_search_hit(item, download_url, graph, download_dir, stopped=None):
+    with span("download") as timing, tempfile.NamedTemporaryFile(dir=download_dir, delete=False) as f:
+        size = graph.download(download_url, f, cancelled=stopped, authenticate=False)
+        timing["bytes"], timing["items"] = size or 0, int(size is not None)
+    if size is None:
+        try:
+            os.remove(f.name)
+        except OSError:
+            pass
+        return None, None, None
+    return item['name'], f.name, None
+
+
+# Downloads and parses search hits concurrently, passing each file's text chunks to
+# index_file(name, chunks, item) as soon as it is ready. Only the max_files best-ranked hits that
+# aren't cached are downloaded. Returns whether everything finished before the deadline (or the
+# `cancelled` event), and [(item, file name, error)] for the files that couldn't be read
+def ingest_search_results(site_id, search_results, graph, file_cache, index_file, download_pool, parse_pool,
+                          deadline_seconds=20, extract_limits=None, cancelled=None, max_files=100):
+    # The deadline covers the download URL lookups as well
+    deadline = time.monotonic() + deadline_seconds
+    misses = []
+    for item in search_results:
+        cached = file_cache.get(item['id'], item.get('eTag'))
+        if cached:
+            index_file(cached[0], [cached[1]], item)
+        elif 'file' in item:
+            misses.append(item)
+    misses = misses[:max_files]
+    if not misses:
+        return True, []
+
+    download_urls = get_download_urls(site_id, misses, graph, deadline, cancelled)
+    errors = []
+    # Downloads still running after the deadline or a cancellation stop at their next chunk
+    # once `stopped` is set, before their directory is removed
+    stopped = threading.Event()
+    download_dir = tempfile.mkdtemp(prefix="question-")
+    try:
+        results = download_and_parse(
+            [item for item in misses if item['id'] in download_urls],
+            bind_request(lambda item: download_search_hit(item, download_urls[item['id']], graph, download_dir, stopped)),
+            functools.partial(extract_file, **(extract_limits or {})), download_pool, parse_pool, deadline, cancelled)
+        for item, file_name, path, chunks, parse_seconds, error in results:
+            if error:
+                errors.append((item, file_name or item['name'], error))
+                continue
+            if path is not None:
+                # Parsing runs in another process, so it is recorded from the time it reported
+                observe("parse", parse_seconds, os.path.getsize(path), len(chunks), file=file_name)
+                with open(path, 'rb') as f:
+                    file_cache.put_file(item['id'], item.get('eTag'), file_name, f, ' '.join(chunks), parse_seconds)
+                os.remove(path)
+            index_file(file_name, chunks, item)
+    finally:
+        stopped.set()
+        shutil.rmtree(download_dir, ignore_errors=True)
+    return time.monotonic() < deadline and not (cancelled and cancelled.is_set()), errors
+
+
+# Searches a site, or its local mirror, for a question and passes each hit's text to
+# add_document(item, name, chunks): first what the shared document store already holds, then
+# the files downloaded and parsed before the deadline, at most max_files of them. The deadline
+# covers the search too. search_results skips the search, for instance with the hits of a
+# federated search. Returns (search results, whether everything finished before the deadline,
+# [(file name, error)])
+def gather_documents(site_id, question, graph, file_cache, document_store, add_document, download_pool,
+                     parse_pool, deadline_seconds=20, extract_limits=None, mirror=None, cancelled=None,
+                     search_results=None, max_files=100):
+    deadline = time.monotonic() + deadline_seconds
+    if mirror and search_results is None:
+        with span("search", mirror=True) as timing:
+            search_results = mirror.search(question)
+            timing["items"] = len(search_results)
+        for item in search_results:
+            if cancelled is not None and cancelled.is_set():
+                return search_results, False, []
+            mirrored = mirror.text(item['id'])
+            if mirrored:
+                add_document(item, mirrored[0], [mirrored[1]])
+        return search_results, True, []
+
+    if search_results is None:
+        search_results = search_files(site_id, question, graph, deadline=deadline)
+    unread = []
+    for item in search_results:
+        shared = document_store.get(item['id'], item.get('eTag'))
+        if shared:
+            add_document(item, shared[0], [shared[1]])
+        elif 'file' in item:
+            unread.append(item)
+    completed, errors = ingest_search_results(
+        site_id, unread, graph, file_cache, lambda name, chunks, item: add_document(item, name, chunks),
+        download_pool, parse_pool, max(deadline - time.monotonic(), 0), extract_limits, cancelled, max_files)
+    return search_results, completed, errors
+
+
+def preprocess_content(content):
+    lines = content.split('\n')
+    processed_lines = [line for line in lines if len(
+        line.split()) > 3 and not line.strip().startswith('http')]
+    return ' '.join(processed_lines)
+
+
+def search_answer(question, index, top_k=TOP_K_SENTENCES, threshold=0.2):
+    if not len(index):
+        return "I couldn't find any content in the files to answer the question."
+
+    answers_dict = {}
+
+    with span("score", sentences=len(index)) as timing:
+        results = index.search(question, top_k=top_k, threshold=threshold)
+        timing["items"] = len(results)
+
+    for score, sentence, doc_name in results:
+        sentence = sentence.strip()
+        # Remove citations and irrelevant information
+        sentence = re.sub(r'\[[^\]]*\]', '', sentence)
+        sentence = re.sub(r'\s+', ' ', sentence).strip()
+
+        # Check if the sentence is complete and relevant
+        if len(sentence.split()) > 5 and not sentence.startswith("Artificial intelligence") and "founding fathers of AI" not in sentence:
+            if doc_name not in answers_dict:
+                answers_dict[doc_name] = []
+            answers_dict[doc_name].append(sentence)
+
+    if answers_dict:
+        answer = "Here's what I found about your question:\n\n"
+        for doc_name, relevant_sentences in answers_dict.items():
+            combined_answer = ' '.join(relevant_sentences)
+            combined_answer = combined_answer.capitalize()
+            if not combined_answer.endswith('.'):
+                combined_answer += '.'
+            answer += f"**Source: {doc_name}**\n{combined_answer}\n\n"
+    else:
+        answer = "I'm sorry, but I couldn't find any relevant information to answer your question."
+
+    return answer
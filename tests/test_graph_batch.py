@@ -0,0 +1,42 @@
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+import pytest
+
+from fake_graph import FakeGraph
+from graph_client import GraphClient
+from sharepoint import get_download_urls
+
+
+@pytest.fixture
+def fake():
+    fake = FakeGraph().start()
+    yield fake
+    fake.stop()
+
+
+def test_twenty_lookups_take_one_batch_round_trip(fake):
+    site_id = fake.add_site("Batch")
+    items = [{"id": fake.add_file(site_id, f"docs/file{number}.txt", b"hello world"), "name": f"file{number}.txt"}
+             for number in range(20)]
+    graph = GraphClient(base_url=fake.url("/v1.0"))
+
+    download_urls = get_download_urls(site_id, items, graph)
+
+    assert set(download_urls) == {item["id"] for item in items}
+    assert fake.round_trips == {"batch": 1}
+
+
+def test_batch_splits_at_twenty_and_keeps_order(fake):
+    site_id = fake.add_site("Batch")
+    file_ids = [fake.add_file(site_id, f"file{number}.txt", b"hello world") for number in range(21)]
+    graph = GraphClient(base_url=fake.url("/v1.0"))
+
+    results = graph.batch([f"/sites/{site_id}/drive/items/{item_id}" for item_id in file_ids])
+
+    assert [body["id"] for _, body in results] == file_ids
+    assert fake.round_trips == {"batch": 2}
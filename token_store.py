@@ -0,0 +1,148 @@
+import hashlib
+import os
+import threading
+import time
+
+import msal
+
+
+class TokenStore:
+    # Per-user MSAL token caches, kept in memory and shared by every session of the process.
+    # Access tokens of users with an active session (one that asked for their headers within
+    # idle_timeout seconds) are refreshed in the background before they expire, so callers get
+    # a valid bearer header without waiting on a token round trip. A user who hasn't been active
+    # for forget_after seconds is dropped, refresh token and all, and signs in again. Nothing is
+    # written to disk: after a restart no session knows its user anyway, so everyone signs in again.
+
+    def __init__(self, client_id, authority, client_credential, scopes, redirect_uri, cache_dir=None,
+                 refresh_margin=600, check_interval=60, code_ttl=300, idle_timeout=1800, forget_after=8 * 3600):
+        self.client_id = client_id
+        self.authority = authority
+        self.client_credential = client_credential
+        self.scopes = scopes
+        self.redirect_uri = redirect_uri
+        self.refresh_margin = refresh_margin
+        self.check_interval = check_interval
+        self.code_ttl = code_ttl
+        self.idle_timeout = idle_timeout
+        self.forget_after = forget_after
+        self.lock = threading.Lock()
+        self.users = {}
+        # Redeemed codes, kept only for code_ttl seconds: code hash -> (user, expiry)
+        self.codes = {}
+        # Earlier versions kept redeemed codes and every user's refresh token in cache_dir in
+        # plain text, for good
+        if cache_dir and os.path.isdir(cache_dir):
+            for name in os.listdir(cache_dir):
+                if name.endswith((".json", ".tmp")):
+                    try:
+                        os.remove(os.path.join(cache_dir, name))
+                    except OSError:
+                        pass
+        self.refresher = threading.Thread(target=self.refresh_loop, daemon=True)
+        self.refresher.start()
+
+    def build_app(self, cache):
+        return msal.ConfidentialClientApplication(
+            self.client_id, authority=self.authority, client_credential=self.client_credential, token_cache=cache)
+
+    def user(self, user_key):
+        with self.lock:
+            entry = self.users.get(user_key)
+            if entry is None:
+                # A user that was dropped, or never signed in here, has nothing to refresh with
+                cache = msal.SerializableTokenCache()
+                entry = self.users[user_key] = {
+                    "cache": cache, "app": self.build_app(cache), "lock": threading.Lock(),
+                    "headers": None, "expires_at": 0, "refreshing": False, "error": None, "used_at": time.time()}
+            return entry
+
+    def apply_result(self, entry, result):
+        if "access_token" not in result:
+            entry["error"] = result.get("error_description", result.get("error", "Unknown error"))
+            return False
+        entry["headers"] = {'Authorization': f'Bearer {result["access_token"]}'}
+        entry["expires_at"] = time.time() + int(result.get("expires_in", 3600))
+        entry["error"] = None
+        return True
+
+    # Redeems an authorization code once and returns (user_key, error); redeeming the same
+    # code again within code_ttl seconds, e.g. after a browser refresh, returns the user it was
+    # redeemed for
+    def redeem_code(self, auth_code):
+        code_hash = hashlib.sha256(auth_code.encode()).hexdigest()
+        now = time.time()
+        with self.lock:
+            self.codes = {key: value for key, value in self.codes.items() if value[1] > now}
+            if code_hash in self.codes:
+                return self.codes[code_hash][0], None
+        cache = msal.SerializableTokenCache()
+        result = self.build_app(cache).acquire_token_by_authorization_code(
+            auth_code, scopes=self.scopes, redirect_uri=self.redirect_uri)
+        if "access_token" not in result:
+            return None, result.get("error_description", "Unknown error")
+        claims = result.get("id_token_claims", {})
+        user_key = f"{claims.get('oid', '')}.{claims.get('tid', '')}"
+        with self.lock:
+            self.users[user_key] = entry = {
+                "cache": cache, "app": self.build_app(cache), "lock": threading.Lock(),
+                "headers": None, "expires_at": 0, "refreshing": False, "error": None, "used_at": now}
+            self.codes[code_hash] = (user_key, now + self.code_ttl)
+        self.apply_result(entry, result)
+        return user_key, None
+
+    def refresh(self, user_key, force=True):
+        entry = self.user(user_key)
+        with entry["lock"]:
+            try:
+                accounts = entry["app"].get_accounts()
+                result = None
+                if accounts:
+                    result = entry["app"].acquire_token_silent(self.scopes, account=accounts[0], force_refresh=force)
+                if result is None:
+                    entry["error"] = "The session has expired. Please sign in again."
+                else:
+                    self.apply_result(entry, result)
+            finally:
+                entry["refreshing"] = False
+        return entry["headers"] if time.time() < entry["expires_at"] else None
+
+    # Returns the user's bearer header. Only blocks when the token has already expired;
+    # a token inside the refresh margin is returned while a new one is fetched in the background.
+    # Work done in the background on a user's behalf passes active=False, so it doesn't count
+    # as the user being active and keep their tokens refreshed
+    def headers(self, user_key, active=True):
+        entry = self.user(user_key)
+        now = time.time()
+        if active:
+            entry["used_at"] = now
+        if entry["headers"] and now < entry["expires_at"]:
+            if now > entry["expires_at"] - self.refresh_margin:
+                self.refresh_in_background(user_key, entry)
+            return entry["headers"]
+        return self.refresh(user_key, force=False)
+
+    def refresh_in_background(self, user_key, entry):
+        with self.lock:
+            if entry["refreshing"]:
+                return
+            entry["refreshing"] = True
+        threading.Thread(target=self.refresh, args=(user_key,), daemon=True).start()
+
+    def refresh_loop(self):
+        while True:
+            time.sleep(self.check_interval)
+            now = time.time()
+            with self.lock:
+                self.users = {user_key: entry for user_key, entry in self.users.items()
+                              if now - entry["used_at"] <= self.forget_after}
+                users = list(self.users.items())
+            for user_key, entry in users:
+                # A user without an active session is refreshed on their next request instead
+                if now - entry["used_at"] > self.idle_timeout:
+                    continue
+                if entry["headers"] and now > entry["expires_at"] - self.refresh_margin:
+                    self.refresh_in_background(user_key, entry)
+
+    def error(self, user_key):
+        return self.user(user_key)["error"]